@@ -0,0 +1,117 @@
+"""Settings for the frame, and the locations and credentials it reads from flash.
+
+Edit the constants here. locations() and credentials() read
+/locations.json and secrets.py the first time they are asked for, so
+importing this module (or any other) touches neither flash nor hardware."""
+
+import sys
+import json
+import time
+
+# Constants
+I2C_SDA_PIN = 4
+I2C_SCL_PIN = 5
+HOLD_VSYS_EN_PIN = 2
+UPDATE_INTERVAL = 60  # 1 minute in seconds; where the adaptive interval starts
+MIN_UPDATE_INTERVAL = 30  # seconds; bounds for the adaptive interval, set both to UPDATE_INTERVAL to fix it
+MAX_UPDATE_INTERVAL = 600  # seconds; also used all night
+CHANGE_THRESHOLD = 200  # watts of change in PV, load, battery or grid between polls that halves the interval
+SHARP_CHANGE = 1500  # watts of load change between polls that drops straight to MIN_UPDATE_INTERVAL
+#UPDATE_INTERVAL = 1
+SCHEDULER_MODE = "loop"  # "loop" stays awake between screens, "deep_sleep" powers off until an RTC alarm
+STATE_FILE = "/state.json"  # Next screen and cached data, kept across deep sleep
+PROFILING = True  # Time each phase of the cycle; cheap enough to leave on
+PROFILE_FILE = None  # e.g. "/profile.bin" to also save the profile to flash each cycle
+BOOT_BUDGET_MS = 3000  # ms from reset until the first frame goes to the panel, not counting the panel's refresh
+LKG_FILE = "/lkg.bin"  # Last good data from each source, drawn straight after power-on
+LKG_WRITE_INTERVAL = 900  # seconds between writes of the last good data, to spare the flash
+HISTORY_FILE = "/history.bin"  # The last day's power readings, for the usage screen's sparklines
+HISTORY_STEP = 900  # seconds per point of the sparklines; a multiple of the day chart's 5 minutes
+HISTORY_BLOCK = 8  # steps of history appended to flash at a time
+HISTORY_BACKFILL_GAP = 3600  # seconds missing from the history before it is refilled from the plants' day charts
+FORCE_REFRESH_EVERY = 10  # Refresh an unchanged screen after skipping it this many times, to clear ghosting (0 = never)
+TOKEN_FILE = "/token.json"
+TOKEN_REFRESH_MARGIN = 300  # Refresh the bearer token this many seconds before it expires
+MAX_INFLIGHT_REQUESTS = 2  # Each open TLS socket costs the Pico W roughly 20-40KB of heap
+POOL_MAX_IDLE = 2  # Idle keep-alive connections kept open; they count towards MAX_INFLIGHT_REQUESTS sockets
+KEEPALIVE_IDLE = 90  # seconds before an idle connection is assumed closed by the server
+HTTP_TIMEOUT = 20  # seconds
+STREAM_CHUNK_SIZE = 256  # bytes read from the socket at a time when extracting JSON fields
+RETRY_ATTEMPTS = 3  # Attempts per request, including the first
+RETRY_BASE_DELAY = 2  # seconds, doubled after each failed attempt
+RETRY_MAX_DELAY = 30  # seconds, also caps any Retry-After from the server
+BREAKER_THRESHOLD = 3  # Failed requests in a row before an endpoint's circuit breaker opens
+BREAKER_COOLDOWN = 300  # seconds an open breaker serves the last good response before retrying
+DATA_SOURCE = "flow"  # "flow" polls the plant energy-flow endpoint, "realtime" the four inverter endpoints
+INVERTER_SNAPSHOT_TTL = 150  # seconds; one usage fetch serves both weather screens that follow it
+PLANTS_PAGE_SIZE = 10  # plants requested per page of the plants list
+PLANT_ROWS_SHOWN = 6  # per-plant rows that fit beside the totals on the usage screen
+WEATHER_CACHE_TTL = 900  # Open-Meteo only updates its data every 15 minutes
+WEATHER_CACHE_BUDGET = 24000  # bytes of heap the cached forecasts may take, as estimated by Forecast.size()
+PREFETCH_LEAD = 20  # seconds before a screen is due that its data starts being fetched
+WIFI_BACKOFF_BASE = 5  # seconds to wait before reconnecting after a failed connect, doubled each time
+WIFI_BACKOFF_MAX = 300  # seconds, cap on the reconnect backoff
+NTP_MAX_DRIFT = 2  # seconds the clock may drift before it is resynced
+NTP_MIN_INTERVAL = 3600  # seconds between NTP syncs at the least
+NTP_MAX_INTERVAL = 86400  # seconds between NTP syncs at the most, however little the clock drifts
+LOCATIONS_FILE = "/locations.json"
+BLACK, WHITE, GREEN, BLUE, RED, YELLOW, ORANGE, TAUPE = range(8)
+DOW = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+# MicroPython ports count time from 2000 or 1970; Open-Meteo's unixtime is from 1970
+EPOCH_OFFSET = 946684800 if time.gmtime(0)[0] == 2000 else 0
+
+# Debug Mode
+DEBUG_MODE = False  # Set to False to disable debug output
+
+# Written to LOCATIONS_FILE when there isn't one, for editing
+DEFAULT_LOCATIONS = {
+    'Local': ['51.507351', '-0.127758', 'LON'],
+    'New York': ['40.712776', '-74.005974', 'NYC'],
+    'Singapore': ['1.352083', '103.819839', 'SGP'],
+    'Manchester': ['53.480759', '-2.242631', 'MAN'],
+    'Malmo': ['55.604980', '13.003822', 'MMX'],
+    'ListOrder': ['Manchester', 'Singapore', 'Malmo', 'New York', 'Local']
+}
+
+_loaded = {}  # 'locations', 'credentials' -> what was read, once it has been
+
+
+def debug_print(message):
+    """Utility function to print debug messages when DEBUG_MODE is enabled."""
+    if DEBUG_MODE:
+        print(message)
+
+
+def locations():
+    """The locations by name, plus 'ListOrder' for the remote screen, loaded or created on first use."""
+    if 'locations' not in _loaded:
+        try:
+            with open(LOCATIONS_FILE, "r") as f:
+                _loaded['locations'] = json.load(f)
+        except OSError:
+            _loaded['locations'] = DEFAULT_LOCATIONS
+            with open(LOCATIONS_FILE, "w") as f:
+                json.dump(DEFAULT_LOCATIONS, f)
+    return _loaded['locations']
+
+
+def local_location():
+    """[latitude, longitude, short name] of the frame's own location."""
+    return locations()['Local']
+
+
+def credentials():
+    """Return (email, password, inverter serials) from secrets.py, imported on first use."""
+    if 'credentials' not in _loaded:
+        try:
+            from secrets import SUN_EMAIL, SUN_PW, SUN_SERIAL
+        except ImportError:
+            print("Create a 'secrets.py' file with your SunSync credentials")
+            sys.exit(1)
+        # SUN_SERIAL may name several inverters, as a list or comma-separated
+        if isinstance(SUN_SERIAL, str):
+            serials = [serial.strip() for serial in SUN_SERIAL.split(",") if serial.strip()]
+        else:
+            serials = list(SUN_SERIAL)
+        _loaded['credentials'] = (SUN_EMAIL, SUN_PW, serials)
+    return _loaded['credentials']
@@ -0,0 +1,137 @@
+"""Screens drawn from display lists, so only what changed is redrawn.
+
+A command is a tuple
+
+    (z, pen, font, thickness, method, args)
+
+run as graphics.<method>(*args), or method(*args) if method is a function,
+with the pen, font and thickness set first (None leaves them as they are).
+Commands are sorted by z and then by pen, font and thickness, so every
+command sharing a style runs after a single set_pen() and friends; anything
+that must be drawn over something else goes in a higher z.
+
+A Layout is a screen's static chrome, compiled (sorted) once when the
+layout is built, and its Slots. Each slot has a fixed box, a background
+colour, chrome of its own and a draw function turning the slot's value
+into commands. DisplayList.show() draws a layout:
+
+- if the framebuffer holds another screen it is cleared, and the layout's
+  chrome and every slot are drawn;
+- if it already holds this layout, only the slots whose value changed are
+  drawn, each after filling its box with its background.
+
+Slot boxes must not overlap each other or the layout's chrome."""
+
+# Fields of a command
+Z, PEN, FONT, THICKNESS, METHOD, ARGS = range(6)
+
+
+def style_key(command):
+    return command[Z], command[PEN], command[FONT] or "", command[THICKNESS] or 0
+
+
+def compile_commands(commands):
+    """Return the commands sorted for drawing with the fewest state changes."""
+    return sorted(commands, key=style_key)
+
+
+def text(pen, font, thickness, string, x, y, wordwrap=800, scale=2, angle=0, spacing=1, z=1):
+    return (z, pen, font, thickness, "text", (string, x, y, wordwrap, scale, angle, spacing))
+
+
+def rectangle(pen, x, y, width, height, z=0):
+    return (z, pen, None, None, "rectangle", (x, y, width, height))
+
+
+def line(pen, x1, y1, x2, y2, thickness=1, z=1):
+    return (z, pen, None, None, "line", (x1, y1, x2, y2, thickness))
+
+
+def triangle(pen, x1, y1, x2, y2, x3, y3, z=1):
+    return (z, pen, None, None, "triangle", (x1, y1, x2, y2, x3, y3))
+
+
+class Slot:
+    """A dynamic region of a screen: draw(value) returns its commands."""
+
+    def __init__(self, name, box, draw, background, chrome=()):
+        self.name = name
+        self.box = box  # (x, y, width, height) that everything the slot draws stays within
+        self.draw = draw
+        self.background = background
+        self.chrome = compile_commands(chrome)
+
+
+class Layout:
+    """A screen's static chrome and its slots."""
+
+    def __init__(self, name, chrome, slots):
+        self.name = name
+        self.chrome = compile_commands(chrome)
+        self.slots = slots
+
+
+class DisplayList:
+    """Draws layouts on a PicoGraphics, tracking what its framebuffer holds."""
+
+    def __init__(self, graphics, background):
+        self.graphics = graphics
+        self.background = background
+        self.showing = None  # name of the layout in the framebuffer
+        self.values = {}  # slot name -> value drawn, for that layout
+        self.pen = self.font = self.thickness = None
+        self.stats = {'full': 0, 'partial': 0, 'commands': 0, 'state_changes': 0}
+
+    def invalidate(self):
+        """Forget what the framebuffer holds, so the next show() draws everything."""
+        self.showing = None
+        self.values = {}
+
+    def show(self, layout, values):
+        """Draw a layout with the given slot values; returns the number of slots drawn."""
+        if self.showing != layout.name:
+            self.set_style(self.background, None, None)
+            self.graphics.clear()
+            commands = list(layout.chrome)
+            changed = layout.slots
+            self.values = {}
+            self.stats['full'] += 1
+        else:
+            commands = []
+            changed = [slot for slot in layout.slots if self.values.get(slot.name) != values.get(slot.name)]
+            for slot in changed:
+                commands.append(rectangle(slot.background, *slot.box, z=-1))
+            self.stats['partial'] += 1
+        for slot in changed:
+            value = values.get(slot.name)
+            commands.extend(slot.chrome)
+            commands.extend(slot.draw(value))
+            self.values[slot.name] = value
+        self.run(compile_commands(commands))
+        self.showing = layout.name
+        return len(changed)
+
+    def set_style(self, pen, font, thickness):
+        if pen is not None and pen != self.pen:
+            self.graphics.set_pen(pen)
+            self.pen = pen
+            self.stats['state_changes'] += 1
+        if font is not None and font != self.font:
+            self.graphics.set_font(font)
+            self.font = font
+            self.stats['state_changes'] += 1
+        if thickness is not None and thickness != self.thickness:
+            self.graphics.set_thickness(thickness)
+            self.thickness = thickness
+            self.stats['state_changes'] += 1
+
+    def run(self, commands):
+        """Run compiled commands."""
+        for command in commands:
+            self.set_style(command[PEN], command[FONT], command[THICKNESS])
+            method = command[METHOD]
+            if isinstance(method, str):
+                getattr(self.graphics, method)(*command[ARGS])
+            else:
+                method(*command[ARGS])
+        self.stats['commands'] += len(commands)
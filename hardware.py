@@ -0,0 +1,92 @@
+"""The Inky Frame's hardware, set up on first use.
+
+Each accessor imports its driver and sets the device up the first time it
+is called, then hands back the same object, so importing the rest of the
+app touches no hardware and a deep sleep wake only sets up what the screen
+it draws needs. hold_power() is the exception to wait for: main() calls it
+before anything else, as the board powers off when woken by a button or
+the RTC unless the vsys hold pin is raised."""
+
+from config import I2C_SDA_PIN, I2C_SCL_PIN, HOLD_VSYS_EN_PIN, WHITE
+
+_devices = {}  # name -> device, once it has been set up
+
+
+def hold_power():
+    """Keep the board powered on battery by raising the vsys hold pin; returns the pin."""
+    if 'vsys' not in _devices:
+        from machine import Pin
+        pin = Pin(HOLD_VSYS_EN_PIN, Pin.OUT)
+        pin.value(True)
+        _devices['vsys'] = pin
+    return _devices['vsys']
+
+
+def graphics():
+    """The PicoGraphics driving the panel."""
+    if 'graphics' not in _devices:
+        from picographics import PicoGraphics, DISPLAY_INKY_FRAME_7 as DISPLAY
+        _devices['graphics'] = PicoGraphics(DISPLAY)
+    return _devices['graphics']
+
+
+def display():
+    """The DisplayList drawing screens on graphics()."""
+    if 'display' not in _devices:
+        from display_list import DisplayList
+        _devices['display'] = DisplayList(graphics(), WHITE)
+    return _devices['display']
+
+
+def inky():
+    """The inky_helper module, for the buttons and their LEDs, with every LED off at first."""
+    if 'inky' not in _devices:
+        import inky_helper as ih
+        ih.clear_button_leds()
+        ih.led_warn.off()
+        _devices['inky'] = ih
+    return _devices['inky']
+
+
+def rtc():
+    """The PCF85063A, which keeps time and wakes the board while it is powered off."""
+    if 'rtc' not in _devices:
+        from pimoroni_i2c import PimoroniI2C
+        from pcf85063a import PCF85063A
+        _devices['rtc'] = PCF85063A(PimoroniI2C(I2C_SDA_PIN, I2C_SCL_PIN, 100000))
+    return _devices['rtc']
+
+
+def network():
+    """The NetworkManager for the WiFi link."""
+    if 'network' not in _devices:
+        from network_manager import NetworkManager
+        import WIFI_CONFIG
+        _devices['network'] = NetworkManager(WIFI_CONFIG.COUNTRY, status_handler=status_handler)
+    return _devices['network']
+
+
+def status_handler(mode, status, ip):
+    """Handle network status updates."""
+    print(f"Mode: {mode}, Status: {status}, IP: {ip}")
+
+
+def set_clocks(tm):
+    """Set the Pico's RTC to a time.gmtime() tuple, and the PCF85063A from it."""
+    from machine import RTC
+    RTC().datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+    pico_rtc_to_pcf()
+
+
+def pcf_to_pico_rtc():
+    """Set the Pico's RTC from the PCF85063A, which keeps time while the board is off."""
+    from machine import RTC
+    year, month, day, hour, minute, second, dow = rtc().datetime()
+    RTC().datetime((year, month, day, dow, hour, minute, second, 0))
+
+
+def pico_rtc_to_pcf():
+    """Copy the Pico's RTC to the PCF85063A so the time survives a power cut."""
+    from machine import RTC
+    year, month, day, dow, hour, minute, second, _ = RTC().datetime()
+    rtc().datetime((year, month, day, hour, minute, second, dow))
@@ -0,0 +1,254 @@
+"""Incremental JSON reader that keeps only the values at requested paths.
+
+Feed it a response body a chunk at a time and it builds a sparse copy of
+the document holding just the requested values, so the full payload never
+has to sit in the heap. Paths use dots for object keys and brackets for
+array elements:
+
+    current.temperature_2m      a single value
+    hourly.time                 a whole array (or object)
+    hourly.temperature_2m[5:8]  elements 5, 6 and 7
+    hourly.time[::3]            every third element, starting with the first
+    data.infos[*].pac           'pac' from every element
+    data.vip[0].power           'power' from the first element
+
+The result mirrors the document's shape, e.g. the last path above gives
+{'data': {'vip': [{'power': 120}]}}, so code written against json.loads()
+output keeps working. Arrays only hold the elements that were selected, so
+hourly.temperature_2m[5:8] comes back as a three element list. If the
+document itself is an array the paths apply to each of its elements.
+
+Strings and numbers being kept are collected in a fixed-size scratch
+buffer; everything else is skipped without being buffered."""
+
+_VALUE, _STRING, _ESCAPE, _UNICODE, _LITERAL = range(5)
+_SKIP, _PARTIAL, _CAPTURE = range(3)
+
+# Frame fields
+_IS_OBJECT, _NODE, _MODE, _ALIVE, _KEY, _COUNT, _EXPECT_KEY = range(7)
+
+_QUOTE, _BACKSLASH = 0x22, 0x5C
+_OPEN_OBJECT, _CLOSE_OBJECT, _OPEN_ARRAY, _CLOSE_ARRAY = 0x7B, 0x7D, 0x5B, 0x5D
+_COMMA = 0x2C
+_SEPARATORS = {0x20, 0x09, 0x0A, 0x0D, 0x2C, 0x3A}
+_LITERAL_END = {0x20, 0x09, 0x0A, 0x0D, 0x2C, 0x7D, 0x5D}
+_ESCAPES = {0x62: 0x08, 0x66: 0x0C, 0x6E: 0x0A, 0x72: 0x0D, 0x74: 0x09}
+
+
+def compile_path(path):
+    """Turn 'a.b[1:3].c' into ['a', 'b', (1, 3, 1), 'c']; [*] becomes (0, None, 1)."""
+    steps = []
+    for part in path.split("."):
+        name, _, rest = part.partition("[")
+        if name:
+            steps.append(name)
+        while rest:
+            index, _, rest = rest.partition("]")
+            if index == "*":
+                steps.append((0, None, 1))
+            elif ":" in index:
+                start, _, stop = index.partition(":")
+                stop, _, step = stop.partition(":")
+                steps.append((int(start) if start else 0, int(stop) if stop else None, int(step) if step else 1))
+            else:
+                steps.append((int(index), int(index) + 1, 1))
+            if rest.startswith("["):
+                rest = rest[1:]
+    return steps
+
+
+def _matches(step, key):
+    if isinstance(step, str):
+        return step == key
+    return isinstance(key, int) and step[0] <= key and (step[1] is None or key < step[1]) \
+        and (key - step[0]) % step[2] == 0
+
+
+class JsonExtractor:
+    """Incremental JSON parser that keeps only the values at the given paths."""
+
+    def __init__(self, paths, max_token=64):
+        self.patterns = [compile_path(path) for path in paths]
+        self.buf = bytearray(max_token)
+        self.view = memoryview(self.buf)
+        self.length = 0  # bytes of the current token held in buf
+        self.buffering = False
+        self.stack = []
+        self.state = _VALUE
+        self.token_mode = _SKIP
+        self.is_key = False
+        self.unicode = 0
+        self.unicode_digits = 0
+        self.root = None
+        self.size = 0  # bytes of values kept, a rough guide to the result's heap use
+
+    def feed(self, chunk):
+        """Parse the next chunk of the document."""
+        i = 0
+        end = len(chunk)
+        while i < end:
+            state = self.state
+            if state == _STRING and not self.buffering:
+                # Fast path: jump to the next quote or backslash
+                quote = chunk.find(b'"', i)
+                backslash = chunk.find(b'\\', i, quote if quote >= 0 else end)
+                if backslash >= 0:
+                    self.state = _ESCAPE
+                    i = backslash + 1
+                elif quote >= 0:
+                    self.end_string()
+                    i = quote + 1
+                else:
+                    i = end
+                continue
+
+            c = chunk[i]
+            if state == _VALUE:
+                if c in _SEPARATORS:
+                    if c == _COMMA and self.stack and self.stack[-1][_IS_OBJECT]:
+                        self.stack[-1][_EXPECT_KEY] = True
+                elif c == _OPEN_OBJECT or c == _OPEN_ARRAY:
+                    self.open_container(c == _OPEN_OBJECT)
+                elif c == _CLOSE_OBJECT or c == _CLOSE_ARRAY:
+                    self.stack.pop()
+                elif c == _QUOTE:
+                    frame = self.stack[-1] if self.stack else None
+                    self.is_key = frame is not None and frame[_IS_OBJECT] and frame[_EXPECT_KEY]
+                    if self.is_key:
+                        self.buffering = frame[_MODE] != _SKIP
+                    else:
+                        self.token_mode = self.child_mode()[0]
+                        self.buffering = self.token_mode == _CAPTURE
+                    self.length = 0
+                    self.state = _STRING
+                else:
+                    self.token_mode = self.child_mode()[0]
+                    self.buffering = self.token_mode == _CAPTURE
+                    self.length = 0
+                    self.state = _LITERAL
+                    continue  # Re-read this byte as part of the literal
+            elif state == _STRING:
+                if c == _QUOTE:
+                    self.end_string()
+                elif c == _BACKSLASH:
+                    self.state = _ESCAPE
+                else:
+                    self.append(c)
+            elif state == _ESCAPE:
+                if c == 0x75:  # \uXXXX
+                    self.unicode = 0
+                    self.unicode_digits = 0
+                    self.state = _UNICODE
+                else:
+                    if self.buffering:
+                        self.append(_ESCAPES.get(c, c))
+                    self.state = _STRING
+            elif state == _UNICODE:
+                self.unicode = self.unicode * 16 + int(chr(c), 16)
+                self.unicode_digits += 1
+                if self.unicode_digits == 4:
+                    if self.buffering:
+                        code = self.unicode
+                        # Lone surrogates can't be encoded on their own
+                        for b in (chr(code) if code < 0xD800 or code > 0xDFFF else "?").encode():
+                            self.append(b)
+                    self.state = _STRING
+            else:  # _LITERAL
+                if c in _LITERAL_END:
+                    self.end_literal()
+                    continue  # The delimiter still needs handling as _VALUE
+                self.append(c)
+            i += 1
+
+    def result(self):
+        """Return the values extracted so far, shaped like the document."""
+        if self.state == _LITERAL:
+            self.end_literal()
+        return self.root
+
+    def append(self, c):
+        if not self.buffering:
+            return
+        if self.length == len(self.buf):
+            raise ValueError("JSON value longer than the scratch buffer")
+        self.buf[self.length] = c
+        self.length += 1
+
+    def token(self):
+        return str(self.view[:self.length], "utf-8")
+
+    def child_mode(self):
+        """Return (mode, alive patterns) for the value starting in the current frame."""
+        if not self.stack:
+            return _PARTIAL, list(range(len(self.patterns)))
+        frame = self.stack[-1]
+        if frame[_IS_OBJECT]:
+            key = frame[_KEY]
+        else:
+            key = frame[_COUNT]
+            frame[_COUNT] += 1
+        if frame[_MODE] != _PARTIAL:
+            return frame[_MODE], None
+
+        depth = len(self.stack) - 1
+        alive = []
+        for i in frame[_ALIVE]:
+            steps = self.patterns[i]
+            if _matches(steps[depth], key):
+                if len(steps) == depth + 1:
+                    return _CAPTURE, None
+                alive.append(i)
+        return (_PARTIAL, alive) if alive else (_SKIP, None)
+
+    def store(self, value):
+        """Attach a kept value to its parent in the result."""
+        if not self.stack:
+            self.root = value
+            return
+        frame = self.stack[-1]
+        if frame[_IS_OBJECT]:
+            frame[_NODE][frame[_KEY]] = value
+        else:
+            frame[_NODE].append(value)
+
+    def open_container(self, is_object):
+        mode, alive = self.child_mode()
+        node = None
+        if mode != _SKIP:
+            node = {} if is_object else []
+            self.store(node)
+            self.size += 16
+        if not self.stack and not is_object:
+            # Paths starting with a key apply to each element of a top-level array
+            self.patterns = [steps if not isinstance(steps[0], str) else [(0, None, 1)] + steps
+                             for steps in self.patterns]
+        self.stack.append([is_object, node, mode, alive, None, 0, is_object])
+
+    def end_string(self):
+        self.state = _VALUE
+        if self.is_key:
+            frame = self.stack[-1]
+            frame[_KEY] = self.token() if self.buffering else None
+            frame[_EXPECT_KEY] = False
+        elif self.token_mode == _CAPTURE:
+            self.size += self.length
+            self.store(self.token())
+        self.buffering = False
+
+    def end_literal(self):
+        self.state = _VALUE
+        if self.token_mode == _CAPTURE:
+            text = self.token()
+            self.size += self.length
+            if text == "true":
+                value = True
+            elif text == "false":
+                value = False
+            elif text == "null":
+                value = None
+            elif "." in text or "e" in text or "E" in text:
+                value = float(text)
+            else:
+                value = int(text)
+            self.store(value)
+        self.buffering = False
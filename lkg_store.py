@@ -0,0 +1,99 @@
+"""Compact on-flash store of the last good data from each source.
+
+Each source's data is kept as one record of bytes with the time it was
+fetched, so screens can be drawn from it straight after power-on. The file
+is a run of records, each
+
+    name length (B), name, timestamp (I), payload length (H), payload
+
+all little-endian. put() only replaces a record with newer data, and
+flush() rewrites the whole file through a temporary file and a rename, at
+most once per write_interval, so a power cut never leaves a torn file and
+the flash sees few writes."""
+
+import os
+import struct
+
+_HEADER = "<IH"  # timestamp, payload length
+
+
+class LastKnownGood:
+    """Last good payload and fetch time for each named source."""
+
+    def __init__(self, path, write_interval):
+        self.path = path
+        self.write_interval = write_interval
+        self.records = {}  # name -> (timestamp, payload bytes)
+        self.dirty = False
+        self.written_at = None
+
+    def load(self):
+        """Read the records saved on flash, keeping none if the file is missing or damaged."""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return
+        records = {}
+        pos = 0
+        try:
+            while pos < len(data):
+                name_length = data[pos]
+                name = data[pos + 1:pos + 1 + name_length].decode()
+                pos += 1 + name_length
+                timestamp, length = struct.unpack_from(_HEADER, data, pos)
+                pos += struct.calcsize(_HEADER)
+                if pos + length > len(data):
+                    raise ValueError("truncated record")
+                records[name] = (timestamp, data[pos:pos + length])
+                pos += length
+        except (ValueError, IndexError, UnicodeError) as e:
+            print(f"Last known good store unreadable ({e}), starting empty")
+            return
+        self.records = records
+        # The file was written no earlier than its newest record, which keeps
+        # flush() rate-limited across reboots
+        if records:
+            self.written_at = max(timestamp for timestamp, _ in records.values())
+
+    def timestamp(self, name):
+        """Return when the named source's record was fetched, or None if there is none."""
+        record = self.records.get(name)
+        return record[0] if record else None
+
+    def put(self, name, timestamp, payload):
+        """Keep a source's payload if it is newer than the stored one."""
+        timestamp = int(timestamp)
+        old = self.records.get(name)
+        if old and old[0] >= timestamp:
+            return
+        if old and old[1] == payload:
+            # Same data: note the newer time, but not worth a flash write of its own
+            self.records[name] = (timestamp, old[1])
+            return
+        self.records[name] = (timestamp, bytes(payload))
+        self.dirty = True
+
+    def discard(self, name):
+        """Drop the named source's record."""
+        if self.records.pop(name, None) is not None:
+            self.dirty = True
+
+    def flush(self, now):
+        """Write the records to flash if any changed and write_interval has passed; returns True if written."""
+        if not self.dirty:
+            return False
+        if self.written_at is not None and now - self.written_at < self.write_interval:
+            return False
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            for name, (timestamp, payload) in self.records.items():
+                encoded = name.encode()
+                f.write(bytes([len(encoded)]))
+                f.write(encoded)
+                f.write(struct.pack(_HEADER, timestamp, len(payload)))
+                f.write(payload)
+        os.rename(temp_path, self.path)
+        self.dirty = False
+        self.written_at = now
+        return True
@@ -0,0 +1,23 @@
+# MicroPython manifest freezing the app into a firmware build, e.g.
+#
+#     make -C ports/rp2 BOARD=<board> FROZEN_MANIFEST=/path/to/sunsync_inky/manifest.py
+#
+# Frozen modules run their bytecode straight from flash, so nothing is
+# compiled and no heap is spent on code at boot. secrets.py, WIFI_CONFIG.py
+# and /locations.json stay on the filesystem, where they can be edited.
+
+include("$(BOARD_DIR)/manifest.py")
+
+module("config.py")
+module("hardware.py")
+module("net.py")
+module("json_stream.py")
+module("weather.py")
+module("sunsynk.py")
+module("power_history.py")
+module("display_list.py")
+module("screens.py")
+module("lkg_store.py")
+module("sleep_scheduler.py")
+module("profiler.py")
+module("sun_sync.py")
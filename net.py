@@ -0,0 +1,579 @@
+"""The WiFi link and a small async HTTPS client for the JSON APIs.
+
+ConnectionManager keeps WiFi up and the clock synced. Requests go over a
+pool of keep-alive connections, at most MAX_INFLIGHT_REQUESTS sockets at a
+time, with retries and backoff, and a circuit breaker per endpoint that
+serves the last good response while the endpoint keeps failing. Response
+bodies can be streamed through a JsonExtractor so only the fields wanted
+are ever held in memory."""
+
+import uasyncio
+import json
+import time
+import random
+
+import hardware
+from config import (KEEPALIVE_IDLE, HTTP_TIMEOUT, STREAM_CHUNK_SIZE, RETRY_ATTEMPTS, RETRY_BASE_DELAY,
+                    RETRY_MAX_DELAY, BREAKER_THRESHOLD, BREAKER_COOLDOWN, MAX_INFLIGHT_REQUESTS, POOL_MAX_IDLE,
+                    WIFI_BACKOFF_BASE, WIFI_BACKOFF_MAX, NTP_MAX_DRIFT, NTP_MIN_INTERVAL, NTP_MAX_INTERVAL,
+                    debug_print)
+from json_stream import JsonExtractor
+import profiler
+from profiler import span
+
+
+class ConnectionManager:
+    """Keeps the WiFi link up and the clock synced without redoing either needlessly.
+
+    ensure() only reconnects when the link has dropped, and after a failed
+    connect waits out a doubling backoff before trying again. The clock is
+    resynced from NTP once the drift measured at the last two syncs predicts
+    it is NTP_MAX_DRIFT out, within NTP_MIN_INTERVAL and NTP_MAX_INTERVAL."""
+
+    def __init__(self):
+        self.failures = 0
+        self.retry_at = 0  # time.time() before which a failed connect isn't retried
+        self.last_sync = None  # time.time() of the last NTP sync
+        self.next_sync = 0
+        self.drift_rate = None  # seconds of drift per second, measured between syncs
+        self.inflight = None  # uasyncio.Event set when the running connect finishes
+        self.stats = {'connect_ms': 0, 'connects': 0, 'failures': 0, 'ntp_syncs': 0}
+
+    async def ensure(self):
+        """Return True once WiFi is connected, connecting if the link is down."""
+        if hardware.network().isconnected():
+            return True
+        if self.inflight:
+            await self.inflight.wait()
+            return hardware.network().isconnected()
+        if time.time() < self.retry_at:
+            return False
+
+        self.inflight = uasyncio.Event()
+        start = time.ticks_ms()
+        import WIFI_CONFIG
+        try:
+            debug_print("Debug: Connect to wifi")
+            with span("wifi connect"):
+                await hardware.network().client(WIFI_CONFIG.SSID, WIFI_CONFIG.PSK)
+        except Exception as e:
+            print(f"WiFi connect failed: {e}")
+        finally:
+            self.stats['connect_ms'] += time.ticks_diff(time.ticks_ms(), start)
+            self.inflight.set()
+            self.inflight = None
+
+        if hardware.network().isconnected():
+            self.failures = 0
+            self.stats['connects'] += 1
+            return True
+        self.failures += 1
+        self.stats['failures'] += 1
+        backoff = min(WIFI_BACKOFF_BASE * 2 ** (self.failures - 1), WIFI_BACKOFF_MAX)
+        self.retry_at = time.time() + backoff
+        print(f"WiFi unavailable, next attempt in {backoff} seconds")
+        return False
+
+    def ntp_due(self):
+        return time.time() >= self.next_sync
+
+    def sync_clock(self):
+        """Set both RTCs from NTP and schedule the next sync from the measured drift."""
+        import ntptime
+        ntp_time = ntptime.time()
+        now = time.time()
+        if self.last_sync is not None and now > self.last_sync:
+            self.drift_rate = abs(ntp_time - now) / (now - self.last_sync)
+            print(f"Clock drifted {ntp_time - now} seconds since the last sync")
+        tm = time.gmtime(ntp_time)
+        hardware.set_clocks(tm)
+
+        interval = NTP_MIN_INTERVAL
+        if self.drift_rate is not None:
+            interval = NTP_MAX_INTERVAL if self.drift_rate == 0 else NTP_MAX_DRIFT / self.drift_rate
+            interval = int(max(NTP_MIN_INTERVAL, min(interval, NTP_MAX_INTERVAL)))
+        self.last_sync = ntp_time
+        self.next_sync = ntp_time + interval
+        self.stats['ntp_syncs'] += 1
+
+    def as_dict(self):
+        """The sync schedule as a JSON-serialisable dict, for keeping across deep sleep."""
+        return {'last_sync': self.last_sync, 'next_sync': self.next_sync, 'drift_rate': self.drift_rate}
+
+    def restore(self, saved):
+        """Put back a sync schedule saved by as_dict()."""
+        for name, value in saved.items():
+            setattr(self, name, value)
+
+    def report(self):
+        """Print and reset this cycle's connection stats."""
+        print(f"WiFi: {self.stats['connect_ms']} ms connecting, {self.stats['connects']} connects, "
+              f"{self.stats['failures']} failures, {self.stats['ntp_syncs']} NTP syncs")
+        for name in self.stats:
+            self.stats[name] = 0
+
+
+connection = ConnectionManager()
+
+
+class RequestError(Exception):
+    """A failed HTTP request, flagged with whether it is worth retrying."""
+
+    def __init__(self, message, retryable=True, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+# Per-endpoint failure counters and last good response, keyed by URL
+endpoint_health = {}
+
+
+def breaker_allows(key):
+    """Return False while the endpoint's circuit breaker is open.
+
+    Once the cooldown has passed the breaker is half-open: one request is let
+    through and its result decides whether the breaker closes again."""
+    health = endpoint_health.get(key)
+    if not health or health['failures'] < BREAKER_THRESHOLD:
+        return True
+    if time.time() - health['opened_at'] >= BREAKER_COOLDOWN:
+        health['opened_at'] = time.time()
+        return True
+    return False
+
+
+def record_success(key, response, keep):
+    """Close the endpoint's breaker, keeping the response as its last known value if keep is True."""
+    if not keep:
+        # A closed breaker with nothing kept is the same as no entry, which keeps the table small
+        endpoint_health.pop(key, None)
+        return
+    health = endpoint_health.setdefault(key, {'failures': 0, 'opened_at': 0, 'last_good': None})
+    health['failures'] = 0
+    health['last_good'] = HttpResponse(response.status_code, response.content, {}, True, response.data, response.size)
+
+
+def record_failure(key):
+    """Count a failed request, opening the breaker once BREAKER_THRESHOLD is reached."""
+    health = endpoint_health.setdefault(key, {'failures': 0, 'opened_at': 0, 'last_good': None})
+    health['failures'] += 1
+    if health['failures'] == BREAKER_THRESHOLD:
+        print(f"Circuit breaker open for {key}")
+        health['opened_at'] = time.time()
+
+
+def last_good(key):
+    """Return the endpoint's last good response, or None if there never was one."""
+    health = endpoint_health.get(key)
+    if health and health['last_good']:
+        debug_print(f"Debug: Using last known response for {key}")
+        return health['last_good']
+    return None
+
+
+def header_value(response, name):
+    """Case-insensitive response header lookup."""
+    headers = getattr(response, 'headers', None) or {}
+    for key, value in headers.items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+
+def check_response(response):
+    """Raise RequestError unless the response is a 200.
+
+    Timeouts, 5xx and 429 are retryable, other 4xx (auth, bad request) are not."""
+    status = response.status_code
+    if status == 200:
+        return
+    retry_after = None
+    if status == 429:
+        try:
+            retry_after = int(header_value(response, 'Retry-After'))
+        except (TypeError, ValueError):
+            pass
+    response.close()
+    raise RequestError(f"HTTP error: {status}", status in (408, 429) or status >= 500, retry_after)
+
+
+def retry_delay(error, attempt):
+    """Return how long to wait before retrying after `error`, or None to give up."""
+    if isinstance(error, RequestError) and not error.retryable:
+        return None
+    if attempt + 1 >= RETRY_ATTEMPTS:
+        return None
+    if getattr(error, 'retry_after', None) is not None:
+        return min(error.retry_after, RETRY_MAX_DELAY)
+    # Equal jitter: half the exponential delay plus a random share of the other half
+    delay = min(RETRY_BASE_DELAY * (2 ** attempt), RETRY_MAX_DELAY)
+    return delay / 2 + random.random() * delay / 2
+
+
+class HttpResponse:
+    """Response returned by the async fetch layer, shaped like a urequests one.
+
+    When the body was streamed through a JsonExtractor, content is None and
+    json() returns the extracted fields instead."""
+
+    def __init__(self, status_code, content, headers, stale=False, data=None, size=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.stale = stale  # True for a last good response served in place of a failed request
+        self.data = data
+        self.size = len(content) if size is None else size  # bytes the body takes in the heap
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def json(self):
+        if self.content is None:
+            return self.data
+        return json.loads(self.content)
+
+    def close(self):
+        pass
+
+
+def split_url(url):
+    """Split a URL into (use_tls, host, port, path)."""
+    scheme, _, rest = url.partition("://")
+    host, slash, path = rest.partition("/")
+    use_tls = scheme == "https"
+    port = 443 if use_tls else 80
+    if ":" in host:
+        host, port = host.split(":")
+        port = int(port)
+    return use_tls, host, port, (slash + path) or "/"
+
+
+async def read_head(reader):
+    """Read an HTTP/1.1 status line and headers, returning (status_code, headers)."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise OSError("Connection closed by server")
+    status_code = int(status_line.split(None, 2)[1])
+    profiler.add_received(len(status_line))
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        profiler.add_received(len(line))
+        if not line or line == b"\r\n":
+            break
+        name, _, value = line.decode().partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return status_code, headers
+
+
+async def read_body(reader, status_code, headers, extractor=None):
+    """Read a response body, handling content-length and chunked encoding.
+
+    With an extractor the body is streamed through it rather than buffered."""
+    if extractor:
+        await stream_body(reader, headers, extractor)
+        return HttpResponse(status_code, None, headers, data=extractor.result(), size=extractor.size)
+
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                # Skip any trailers up to the blank line ending the body
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        content = b"".join(chunks)
+    elif "content-length" in headers:
+        content = await reader.readexactly(int(headers["content-length"]))
+    else:
+        content = await reader.read(-1)
+    profiler.add_received(len(content))
+    return HttpResponse(status_code, content, headers)
+
+
+def reusable(headers):
+    """Return True if the connection can carry another request after this response."""
+    if headers.get("connection", "").lower() == "close":
+        return False
+    # Without a length the body only ends when the server closes the connection
+    return "content-length" in headers or headers.get("transfer-encoding", "").lower() == "chunked"
+
+
+async def stream_body(reader, headers, extractor):
+    """Feed a response body to extractor STREAM_CHUNK_SIZE bytes at a time."""
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            remaining = int((await reader.readline()).split(b";")[0], 16)
+            if remaining == 0:
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                return
+            while remaining:
+                chunk = await reader.readexactly(min(remaining, STREAM_CHUNK_SIZE))
+                extractor.feed(chunk)
+                profiler.add_received(len(chunk))
+                remaining -= len(chunk)
+            await reader.readline()
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        while remaining:
+            chunk = await reader.readexactly(min(remaining, STREAM_CHUNK_SIZE))
+            extractor.feed(chunk)
+            profiler.add_received(len(chunk))
+            remaining -= len(chunk)
+    else:
+        while True:
+            chunk = await reader.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                return
+            extractor.feed(chunk)
+            profiler.add_received(len(chunk))
+
+
+async def close_stream(writer):
+    """Close a connection, ignoring errors from one the server already dropped."""
+    try:
+        writer.close()
+        await writer.wait_closed()
+    except OSError:
+        pass
+
+
+class ConnectionPool:
+    """Keeps connections open after a response so the next request to the host skips the handshake.
+
+    A TLS handshake costs the Pico W one to two seconds of CPU, and nearly
+    every request goes to api.sunsynk.net or api.open-meteo.com. Idle
+    connections share the MAX_INFLIGHT_REQUESTS socket budget with active
+    ones, so the oldest idle connection is closed to make room for a new one."""
+
+    def __init__(self, max_open, max_idle):
+        self.max_open = max_open
+        self.max_idle = max_idle
+        self.idle = []  # [(host, port, use_tls), reader, writer, time.time() it went idle], oldest first
+        self.active = 0
+        self.stats = {'handshakes': 0, 'reused': 0, 'reconnects': 0}
+
+    async def get(self, host, port, use_tls):
+        """Return (reader, writer, reused) for the host, reusing an idle connection if there is one."""
+        key = (host, port, use_tls)
+        now = time.time()
+        for conn in self.idle[:]:
+            if now - conn[3] > KEEPALIVE_IDLE:
+                self.idle.remove(conn)
+                await close_stream(conn[2])
+        for conn in self.idle:
+            if conn[0] == key:
+                self.idle.remove(conn)
+                self.active += 1
+                return conn[1], conn[2], True
+
+        while self.idle and self.active + len(self.idle) >= self.max_open:
+            await close_stream(self.idle.pop(0)[2])
+        self.active += 1
+        try:
+            reader, writer = await uasyncio.open_connection(host, port, ssl=use_tls)
+        except BaseException:
+            self.active -= 1
+            raise
+        self.stats['handshakes'] += 1
+        return reader, writer, False
+
+    async def put(self, host, port, use_tls, reader, writer, keep):
+        """Hand back a connection from get(), keeping it open for reuse if keep is True."""
+        self.active -= 1
+        if keep and len(self.idle) < self.max_idle:
+            self.idle.append([(host, port, use_tls), reader, writer, time.time()])
+        else:
+            await close_stream(writer)
+
+    async def close_all(self):
+        """Close every idle connection, e.g. before going to sleep."""
+        while self.idle:
+            await close_stream(self.idle.pop()[2])
+
+    def report(self):
+        """Print and reset this cycle's handshake stats."""
+        print(f"HTTP: {self.stats['handshakes']} handshakes, {self.stats['reused']} saved by keep-alive, "
+              f"{self.stats['reconnects']} reconnects after the server closed an idle connection")
+        for name in self.stats:
+            self.stats[name] = 0
+
+
+class Limiter:
+    """Counting semaphore, which uasyncio doesn't provide."""
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.freed = uasyncio.Event()
+
+    async def acquire(self):
+        while self.slots == 0:
+            self.freed.clear()
+            await self.freed.wait()
+        self.slots -= 1
+
+    def release(self):
+        self.slots += 1
+        self.freed.set()
+
+
+# Caps open sockets across every concurrent fetch, however they are nested
+socket_limiter = Limiter(MAX_INFLIGHT_REQUESTS)
+connection_pool = ConnectionPool(MAX_INFLIGHT_REQUESTS, POOL_MAX_IDLE)
+
+
+async def async_request(method, url, headers=None, json_body=None, extract=None, timeout=HTTP_TIMEOUT):
+    """Make one HTTP request over a pooled keep-alive connection.
+
+    extract is an optional list of JSON paths (see json_stream) to keep from
+    the body instead of reading all of it into memory. The request times out
+    after `timeout` seconds, not counting any wait for a free socket."""
+    use_tls, host, port, path = split_url(url)
+    await socket_limiter.acquire()
+    try:
+        with span(f"{method} {host}{path.split('?')[0]}" if profiler.enabled else None):
+            return await uasyncio.wait_for(_async_request(method, host, port, path, use_tls, headers, json_body,
+                                                          extract), timeout)
+    finally:
+        socket_limiter.release()
+
+
+async def _async_request(method, host, port, path, use_tls, headers, json_body, extract):
+    body = json.dumps(json_body).encode() if json_body is not None else b""
+    lines = [f"{method} {path} HTTP/1.1", f"Host: {host}", "Connection: keep-alive"]
+    for name, value in (headers or {}).items():
+        lines.append(f"{name}: {value}")
+    if body:
+        lines.append(f"Content-Length: {len(body)}")
+    request = ("\r\n".join(lines) + "\r\n\r\n").encode() + body
+
+    while True:
+        reader, writer, reused = await connection_pool.get(host, port, use_tls)
+        keep = False
+        try:
+            try:
+                writer.write(request)
+                await writer.drain()
+                status_code, response_headers = await read_head(reader)
+            except OSError:
+                # The server may have closed an idle connection; nothing was read, so try a fresh one
+                if not reused:
+                    raise
+                connection_pool.stats['reconnects'] += 1
+                continue
+            if reused:
+                connection_pool.stats['reused'] += 1
+            response = await read_body(reader, status_code, response_headers,
+                                       JsonExtractor(extract) if extract else None)
+            keep = reusable(response_headers)
+            return response
+        finally:
+            await connection_pool.put(host, port, use_tls, reader, writer, keep)
+
+
+async def async_retry_request(method, url, headers=None, json_body=None, extract=None, keep_last_good=False):
+    """Make a request, retrying transient failures with jittered exponential backoff.
+
+    While the endpoint's circuit breaker is open, or once retries are used up,
+    the last good response for the endpoint is returned (None if there is
+    none). Responses are only kept for that with keep_last_good=True, as
+    each one held costs heap for as long as the program runs. A 401 on an
+    authenticated request logs in again once and retries straight away with
+    the new bearer token. Backoff waits yield to other tasks."""
+    key = url
+    if not breaker_allows(key):
+        return last_good(key)
+    if not await connection.ensure():
+        # Not the endpoint's fault, so this doesn't count against its breaker
+        return last_good(key)
+
+    reauthenticated = False
+    attempt = 0
+    while True:
+        try:
+            token_used = headers.get('Authorization') if headers else None
+            response = await async_request(method, url, headers, json_body, extract)
+            if response.status_code == 401 and token_used and not reauthenticated:
+                reauthenticated = True
+                print("Request unauthorised, refreshing bearer token...")
+                # Imported here rather than at the top, as sunsynk is built on this module
+                import sunsynk
+                # Another request may already have logged in again
+                if sunsynk.the_bearer_token_string != token_used or await sunsynk.bearer_token(force=True):
+                    headers['Authorization'] = sunsynk.the_bearer_token_string
+                    continue
+            check_response(response)
+            record_success(key, response, keep_last_good)
+            return response
+        except Exception as e:
+            error = e
+            delay = retry_delay(e, attempt)
+            # Some errors, such as a timeout, have no message of their own
+            reason = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            if delay is None:
+                print(f"Request failed: {reason}")
+                break
+            print(f"Request failed: {reason}, retrying in {delay:.1f} seconds...")
+            await uasyncio.sleep(delay)
+            attempt += 1
+
+    if not isinstance(error, RequestError) or error.retryable:
+        record_failure(key)
+    print("Request failed after retries.")
+    return last_good(key)
+
+
+async def gather_limited(jobs, limit=MAX_INFLIGHT_REQUESTS):
+    """Await job() for each job concurrently, at most `limit` at once.
+
+    Results are returned in job order."""
+    results = [None] * len(jobs)
+    next_job = [0]
+
+    async def worker():
+        while next_job[0] < len(jobs):
+            i = next_job[0]
+            next_job[0] += 1
+            results[i] = await jobs[i]()
+
+    await uasyncio.gather(*[worker() for _ in range(min(limit, len(jobs)))])
+    return results
+
+
+async def fetch_json(method, url, headers=None, allow_stale=True, extract=None):
+    """Fetch a URL and return its decoded JSON, or None on failure.
+
+    With allow_stale=True the response is kept as the endpoint's last good
+    one, and served in its place if a later request fails; allow_stale=False
+    neither keeps it nor accepts one. extract limits the result to the
+    given JSON paths, streaming the body instead of parsing it whole."""
+    response = await async_retry_request(method, url, headers, extract=extract, keep_last_good=allow_stale)
+    if not response or (response.stale and not allow_stale):
+        return None
+    try:
+        with span("json parse"):
+            return response.json()
+    except ValueError as e:
+        print(f"Invalid JSON from {url}: {e}")
+        return None
+
+
+async def fetch_all(jobs, limit=MAX_INFLIGHT_REQUESTS, allow_stale=True):
+    """Fetch (method, url, headers, extract) jobs concurrently, at most `limit` sockets at once.
+
+    Returns the decoded JSON for each job, in job order, or None for any
+    that failed. allow_stale is passed on to fetch_json()."""
+    return await gather_limited([lambda job=job: fetch_json(job[0], job[1], job[2], allow_stale, job[3])
+                                 for job in jobs], limit)
+
+
+def run_async(coro):
+    """Run a coroutine to completion from blocking code."""
+    return uasyncio.get_event_loop().run_until_complete(coro)
@@ -0,0 +1,154 @@
+"""Fixed-size history of power readings for the last day.
+
+Time is cut into steps of step_seconds, and each series keeps one reading
+per step for the last `slots` steps in an array('h') allocated up front, so
+memory use is the same however long the frame runs. Step n lives in slot
+n % slots; steps passed over without a reading are set to MISSING as the
+newest step moves on.
+
+Finished steps are appended to the file as records of
+
+    step (i), one reading (h) per series
+
+gathered into blocks of block_steps records, so the flash sees one small
+append per block. Reading the file back replays the records in order, and
+once it holds two days of records save() rewrites it with only the last
+day's."""
+
+import os
+import struct
+from array import array
+
+MISSING = -32768  # no reading for this step
+
+
+class PowerHistory:
+    """The last `slots` steps of readings for `series` series of watts."""
+
+    def __init__(self, path, step_seconds, slots, series, block_steps):
+        self.path = path
+        self.step_seconds = step_seconds
+        self.slots = slots
+        self.series = [array('h', [MISSING] * slots) for _ in range(series)]
+        self.latest = None  # newest step with a slot, or None when empty
+        self.version = 0  # bumped whenever the readings held change, for render state
+        self.record_format = "<i" + "h" * series
+        self.record_size = struct.calcsize(self.record_format)
+        self.block = bytearray(self.record_size * block_steps)
+        self.pending = 0  # records in block not yet appended to the file
+        self.file_records = 0
+
+    def advance(self, step):
+        """Make `step` the newest step, clearing the slots of the steps skipped."""
+        if self.latest is None:
+            self.latest = step
+            return
+        for skipped in range(max(self.latest + 1, step - self.slots + 1), step + 1):
+            for values in self.series:
+                values[skipped % self.slots] = MISSING
+        self.latest = step
+        self.version += 1
+
+    def put(self, t, readings, keep=False):
+        """Store readings for the step holding Unix time t; keep=True leaves a step that has one alone.
+
+        Returns False if t is older than the history reaches back."""
+        step = t // self.step_seconds
+        if self.latest is None or step > self.latest:
+            self.advance(step)
+        elif step <= self.latest - self.slots:
+            return False
+        slot = step % self.slots
+        if keep and self.series[0][slot] != MISSING:
+            return True
+        for values, reading in zip(self.series, readings):
+            if reading is None or reading == MISSING:
+                reading = MISSING
+            else:
+                reading = max(-32767, min(int(reading), 32767))
+            if values[slot] != reading:
+                values[slot] = reading
+                self.version += 1
+        return True
+
+    def record(self, t, readings):
+        """Store the latest readings, queueing the step before for the file once it is finished."""
+        step = t // self.step_seconds
+        if self.latest is not None and step > self.latest:
+            self.queue(self.latest)
+        self.put(t, readings)
+
+    def queue(self, step):
+        """Add a step's readings to the block, appending the block to the file when it is full."""
+        offset = self.pending * self.record_size
+        struct.pack_into("<i", self.block, offset, step)
+        for i, values in enumerate(self.series):
+            struct.pack_into("<h", self.block, offset + 4 + 2 * i, values[step % self.slots])
+        self.pending += 1
+        if self.pending * self.record_size == len(self.block):
+            self.flush()
+
+    def flush(self, current=False):
+        """Append the queued steps to the file; current=True adds the unfinished newest step too."""
+        if current and self.latest is not None:
+            # A later record for the same step replaces it when the file is read back
+            self.queue(self.latest)
+        if not self.pending:
+            return
+        if self.file_records >= 2 * self.slots:
+            self.save()
+            return
+        with open(self.path, "ab") as f:
+            f.write(memoryview(self.block)[:self.pending * self.record_size])
+        self.file_records += self.pending
+        self.pending = 0
+
+    def save(self):
+        """Rewrite the file with the steps held now, through a temporary file and a rename."""
+        temp_path = self.path + ".tmp"
+        record = bytearray(self.record_size)
+        count = 0
+        with open(temp_path, "wb") as f:
+            for step in self.steps():
+                slot = step % self.slots
+                if all(values[slot] == MISSING for values in self.series):
+                    continue
+                struct.pack_into("<i", record, 0, step)
+                for i, values in enumerate(self.series):
+                    struct.pack_into("<h", record, 4 + 2 * i, values[slot])
+                f.write(record)
+                count += 1
+        os.rename(temp_path, self.path)
+        self.file_records = count
+        self.pending = 0
+
+    def load(self):
+        """Read back the history saved in the file, if there is one."""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return
+        count = len(data) // self.record_size
+        for i in range(count):
+            record = struct.unpack_from(self.record_format, data, i * self.record_size)
+            self.put(record[0] * self.step_seconds, record[1:])
+        self.file_records = count
+
+    def gap(self, t):
+        """Seconds from the newest step to Unix time t, or None if the history is empty."""
+        if self.latest is None:
+            return None
+        return t - self.latest * self.step_seconds
+
+    def steps(self):
+        """Each step the history holds, oldest first."""
+        if self.latest is None:
+            return range(0)
+        return range(self.latest - self.slots + 1, self.latest + 1)
+
+    def points(self, index):
+        """Yield one series' readings for each step, oldest first, with MISSING where there is none."""
+        values = self.series[index]
+        for step in self.steps():
+            yield values[step % self.slots]
@@ -0,0 +1,143 @@
+"""Lightweight timing and heap instrumentation.
+
+Wrap a phase of work in a span:
+
+    with span("wifi"):
+        connect()
+
+A name built at run time costs a string each time, so build it only when
+profiling:
+
+    with span(f"draw {name}" if profiler.enabled else None):
+        ...
+
+Each span records its elapsed ticks_ms, the change in gc.mem_alloc() and
+the bytes the HTTP layer reported through add_received() while it ran.
+Records go into a fixed-size ring buffer of arrays, so memory use doesn't
+grow however long the frame runs; summary() gives each phase's min, average
+and max over the records still in the buffer. With enabled = False, span()
+hands back a shared do-nothing object and records nothing."""
+
+import gc
+import json
+import time
+from array import array
+
+RING_SIZE = 128  # spans kept, about five update() cycles; older ones are overwritten
+
+enabled = True
+names = []  # phase names, indexed by the phase numbers in the ring
+received = 0  # bytes received so far, see add_received()
+
+_phase = array('B', [0] * RING_SIZE)
+_ms = array('i', [0] * RING_SIZE)
+_heap = array('i', [0] * RING_SIZE)
+_bytes = array('i', [0] * RING_SIZE)
+_next = 0  # ring slot the next record goes in
+_count = 0  # records held, at most RING_SIZE
+
+
+def add_received(count):
+    """Count bytes received from the network, for the spans running now."""
+    global received
+    received += count
+
+
+def record(name, ms, heap, received_bytes):
+    """Add a finished span to the ring buffer."""
+    global _next, _count
+    try:
+        phase = names.index(name)
+    except ValueError:
+        if len(names) == 256:
+            return
+        phase = len(names)
+        names.append(name)
+    _phase[_next] = phase
+    _ms[_next] = ms
+    _heap[_next] = heap
+    _bytes[_next] = received_bytes
+    _next = (_next + 1) % RING_SIZE
+    _count = min(_count + 1, RING_SIZE)
+
+
+class Span:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.ticks_ms()
+        self.heap = gc.mem_alloc()
+        self.received = received
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.name, time.ticks_diff(time.ticks_ms(), self.start), gc.mem_alloc() - self.heap,
+               received - self.received)
+        return False
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """Return a context manager that records the time, heap and bytes used inside it."""
+    if not enabled:
+        return _NO_SPAN
+    return Span(name)
+
+
+def records():
+    """Yield (name, ms, heap delta, bytes received) for each record, oldest first."""
+    start = (_next - _count) % RING_SIZE
+    for i in range(_count):
+        slot = (start + i) % RING_SIZE
+        yield names[_phase[slot]], _ms[slot], _heap[slot], _bytes[slot]
+
+
+def summary():
+    """Return {name: [count, min ms, avg ms, max ms, avg heap delta, avg bytes]} over the ring buffer."""
+    totals = {}
+    for name, ms, heap, received_bytes in records():
+        entry = totals.get(name)
+        if entry is None:
+            totals[name] = [1, ms, ms, ms, heap, received_bytes]
+        else:
+            entry[0] += 1
+            entry[1] = min(entry[1], ms)
+            entry[2] += ms
+            entry[3] = max(entry[3], ms)
+            entry[4] += heap
+            entry[5] += received_bytes
+    for entry in totals.values():
+        count = entry[0]
+        entry[2] //= count
+        entry[4] //= count
+        entry[5] //= count
+    return totals
+
+
+def dump():
+    """Print each phase's rolling stats over serial."""
+    if not _count:
+        return
+    print("Phase: count, min/avg/max ms, avg heap delta, avg bytes received")
+    for name, (count, low, average, high, heap, received_bytes) in summary().items():
+        print(f"  {name}: {count}, {low}/{average}/{high} ms, {heap} B heap, {received_bytes} B rx")
+
+
+def save(path):
+    """Write the ring buffer to flash: a JSON header line, then the raw arrays."""
+    with open(path, "wb") as f:
+        f.write(json.dumps({'names': names, 'next': _next, 'count': _count, 'size': RING_SIZE}).encode())
+        f.write(b"\n")
+        for values in (_phase, _ms, _heap, _bytes):
+            f.write(values)
@@ -0,0 +1,381 @@
+"""The screens: what each one shows, its layout, and drawing it on the panel.
+
+Each screen fetches its data (or, with fetch=False, takes it from the
+caches) and builds a small immutable state tuple holding everything it
+draws, then hands it to render_screen() with its layout and a function
+turning the state into the layout's slot values."""
+
+import uasyncio
+import gc
+import time
+
+import config
+import hardware
+from config import (FORCE_REFRESH_EVERY, INVERTER_SNAPSHOT_TTL, PLANT_ROWS_SHOWN, WEATHER_CACHE_TTL, DOW,
+                    EPOCH_OFFSET, BLACK, WHITE, GREEN, BLUE, RED, YELLOW, ORANGE, debug_print)
+from net import run_async
+from weather import (WEATHER_DAILY, weather_for, cached_forecast, forecast_fetched_at, local_utc_offset,
+                     unix_time)
+from sunsynk import inverter, power_history, get_soc
+from display_list import Layout, Slot, text, rectangle, line, triangle
+from power_history import MISSING
+import profiler
+from profiler import span
+
+LOCAL_CURR_TIME = "??:??"
+LOCAL_CURR_TEMP = "??"
+first_frame_at = [None]  # time.ticks_ms(), ms since reset, when the first frame went to the panel
+
+
+def age_label(fetched_at, ttl):
+    """Return e.g. "25m old" for data fetched more than ttl seconds ago, or "" for fresh data."""
+    if fetched_at is None:
+        return ""
+    age = int(time.time() - fetched_at)
+    if age < ttl:
+        return ""
+    return f"{age // 60}m old" if age < 3600 else f"{age // 3600}h old"
+
+
+def header_values(temperature, age):
+    """Slot values for the header: the time now, how old the data is if stale, and the local temperature."""
+    now = unix_time()
+    local = time.gmtime(now - EPOCH_OFFSET + local_utc_offset(now))
+    timestring = f"{DOW[local[6]]} {local[2]:02d}-{local[1]:02d} {local[3]:02d}:{local[4]:02d}"
+    print(f"{timestring} - Header Now")
+    print(f"{LOCAL_CURR_TIME} - Header Local Weather Data")
+    return {'clock': timestring, 'age': age, 'temperature': temperature}
+
+
+def draw_clock(timestring):
+    return [text(WHITE, "sans", 4, timestring, 15, 35, 800, 2)]
+
+
+def draw_age(age):
+    return [text(ORANGE, "sans", 4, age, 400, 35, 180, 1)] if age else []
+
+
+def draw_header_temperature(temperature):
+    return [text(YELLOW, "sans", 4, f"{temperature}c", 590, 35, 800, 2)]
+
+
+# The black bar across the top of every screen
+HEADER_CHROME = [rectangle(BLACK, 0, 0, 800, 60)]
+HEADER_SLOTS = [
+    Slot('clock', (0, 0, 390, 60), draw_clock, BLACK),
+    Slot('age', (390, 0, 190, 60), draw_age, BLACK),
+    Slot('temperature', (580, 0, 220, 60), draw_header_temperature, BLACK),
+]
+
+
+# Rendering
+# The clock in the header isn't part of a screen's state, so it shows when
+# the screen was last refreshed.
+render_stats = {'performed': 0, 'skipped': 0}
+rendered_states = {}  # screen name -> hash of the state it last displayed
+skipped_renders = {}  # screen name -> refreshes skipped since it was last drawn
+
+
+def render_screen(layout, state, values, force=False):
+    """Draw a screen and refresh the panel, unless the panel already shows it unchanged.
+
+    When this screen is the one on the panel and its state matches the one
+    it was drawn with, both the redraw and the slow e-ink update() are
+    skipped. Every FORCE_REFRESH_EVERY skips the screen is redrawn anyway to
+    clear ghosting. A screen replacing another one is always drawn. If the
+    framebuffer still holds this screen, only the slots whose values
+    changed are drawn. force=True draws and refreshes whatever the state,
+    e.g. for a button press. Returns True if the panel was refreshed."""
+    name = layout.name
+    state_hash = hash(state)
+    skipped = skipped_renders.get(name, 0)
+    on_panel = hardware.display().showing == name
+    if not force and on_panel and rendered_states.get(name) == state_hash and \
+            (FORCE_REFRESH_EVERY == 0 or skipped < FORCE_REFRESH_EVERY):
+        skipped_renders[name] = skipped + 1
+        render_stats['skipped'] += 1
+        print(f"{name} screen unchanged, skipping refresh")
+        return False
+
+    with span(f"draw {name}" if profiler.enabled else None):
+        hardware.display().show(layout, values(state))
+    if first_frame_at[0] is None:
+        first_frame_at[0] = time.ticks_ms()
+    with span("panel update"):
+        hardware.graphics().update()
+    rendered_states[name] = state_hash
+    skipped_renders[name] = 0
+    render_stats['performed'] += 1
+    return True
+
+
+def my_current_usage(fetch=True, force=False):
+    """Retrieve and display current solar usage and weather information.
+
+    With fetch=False the screen is drawn from whatever is already held, such
+    as the last known good data restored at boot. force=True refreshes the
+    panel even if nothing changed (see render_screen())."""
+    global LOCAL_CURR_TEMP, LOCAL_CURR_TIME
+
+    if fetch:
+        # Fetch everything at once; the screen waits only as long as the slowest request
+        local = config.local_location()
+        snapshot, local_weather = run_async(uasyncio.gather(inverter.refresh(), weather_for([local])))
+        forecast = local_weather[0]
+    else:
+        snapshot, forecast = inverter, cached_forecast(config.local_location())
+
+    gc.collect()
+
+    # Without a forecast the header keeps showing the last one it had
+    if forecast and forecast.current_temp is not None:
+        LOCAL_CURR_TEMP = forecast.current_temp
+    if forecast and forecast.current_time:
+        LOCAL_CURR_TIME = forecast.clock(forecast.current_time)
+
+    if not snapshot.rows:
+        print("No plant data, leaving the usage screen as it is")
+        return 0
+
+    # Totals, plus a row per plant when there is more than one
+    rows = tuple(snapshot.rows[:PLANT_ROWS_SHOWN]) if len(snapshot.rows) > 1 else ()
+    state = (LOCAL_CURR_TEMP, snapshot.pv_power, snapshot.load_power, snapshot.battery_power,
+             snapshot.grid_power, snapshot.soc, rows, age_label(snapshot.fetched_at, INVERTER_SNAPSHOT_TTL),
+             power_history.version)
+    render_screen(usage_layout, state, usage_values, force)
+    return snapshot.pv_power
+
+
+def usage_values(state):
+    """Slot values for the usage screen from its render state."""
+    temperature, pv_power, load_power, bat_usage, grid_power, soc, rows, age, history_version = state
+    values = header_values(temperature, age)
+    values.update({'pv': pv_power, 'load': load_power, 'battery_power': bat_usage, 'grid': grid_power,
+                   'plants': rows, 'soc': soc})
+    for series in range(4):
+        values[f"history{series}"] = history_version
+    return values
+
+
+def draw_pv(current_gen_w):
+    return [text(RED if current_gen_w < 100 else GREEN, "sans", 8, f"{current_gen_w}W", 110, 132, 800, 4)]
+
+
+def draw_load(load_power):
+    return [text(BLACK, "sans", 8, f"{load_power}W", 110, 232, 800, 4)]
+
+
+def draw_battery_power(bat_usage):
+    return [text(RED if bat_usage > 0 else GREEN, "sans", 8, f"{abs(bat_usage)}W{'+' if bat_usage > 0 else '-'}",
+                 110, 336, 800, 4)]
+
+
+def draw_grid(grid_power):
+    return [text(BLUE if grid_power > 0 else RED, "sans", 8, f"{abs(grid_power)}W{'-' if grid_power < 0 else ''}",
+                 110, 440, 800, 4)]
+
+
+def draw_sparkline(series, bottom):
+    """Draw the last day of one power_history series as a line above `bottom`."""
+    left, width, height = 110, 230, 12
+    graphics = hardware.graphics()
+    last_step = power_history.slots - 1
+    low = high = None
+    for value in power_history.points(series):
+        if value != MISSING:
+            low = value if low is None else min(low, value)
+            high = value if high is None else max(high, value)
+    if low is None:
+        return
+    scale = high - low or 1
+    previous = None
+    for i, value in enumerate(power_history.points(series)):
+        if value == MISSING:
+            previous = None
+            continue
+        point = (left + i * width // last_step, bottom - (value - low) * height // scale)
+        if previous:
+            graphics.line(previous[0], previous[1], point[0], point[1], 2)
+        previous = point
+
+
+def sparkline_slot(series, bottom):
+    """A slot for the sparkline under one of the PV/Ld/Bt/Gr readings."""
+    return Slot(f"history{series}", (105, bottom - 14, 250, 16),
+                lambda version: [(1, BLACK, None, None, draw_sparkline, (series, bottom))], WHITE)
+
+
+def draw_plant_rows(rows):
+    """List each plant's PV, battery and SOC between the totals and the battery gauge."""
+    if not rows:
+        return []
+    commands = [text(BLACK, "sans", 2, "Pv / Bt / Soc", 360, 95, 220, 0.8)]
+    for i, (label, pv, load_power, bat_usage, grid_power, soc) in enumerate(rows):
+        pv_text = "-" if pv is None else f"{pv}W"
+        bat_text = "-" if bat_usage is None else f"{bat_usage}W"
+        soc_text = "-" if soc is None else f"{soc}%"
+        commands.append(text(BLACK, "sans", 2, f"{label} {pv_text} {bat_text} {soc_text}", 360, 140 + i * 55, 220, 0.7))
+    return commands
+
+
+def my_current_weather(LOCATION, fetch=True, force=False):
+    """Fetch and display the current weather for a given location; fetch=False draws from the caches."""
+    if fetch:
+        forecast, soc = run_async(weather_for([LOCATION]))[0], get_soc()
+    else:
+        forecast, soc = cached_forecast(LOCATION), inverter.soc
+    if not forecast:
+        return
+
+    now = unix_time()
+    state = (LOCATION[2], forecast.current_temp, tuple(forecast.next_hours(now, 3)),
+             tuple(forecast.next_days(now, 3)), soc, age_label(forecast_fetched_at(LOCATION), WEATHER_CACHE_TTL))
+    render_screen(weather_layout, state, weather_values, force)
+    return 1
+
+
+def weather_values(state):
+    """Slot values for the local weather screen from its render state."""
+    short_name, temperature, hours, days, soc, age = state
+    debug_print(f"DEBUG SOC = {soc}")
+    values = header_values(temperature, age)
+    values.update({'hours': hours, 'name': short_name, 'days': days, 'soc': soc})
+    return values
+
+
+def draw_hours(hours):
+    """The hourly forecast for the next few hours."""
+    forecast_title_y = 50
+    forecast_offset = 60
+    commands = []
+    for hci, (hour_label, hour_temperature, rain) in enumerate(hours, 1):
+        y = forecast_title_y + (forecast_offset * hci)
+        commands.append(text(GREEN, "serif", 6, hour_label, 0, y, 800, 2))
+        commands.append(text(BLACK, "sans", 4, f"{hour_temperature:.1f}c {rain}%", 190, y, 800, 2))
+    return commands
+
+
+def draw_location_name(short_name):
+    return [text(RED, "sans", 10, short_name, 530, 130, 800, 4, 0, 1)]
+
+
+def draw_weather_soc(soc):
+    return [text(BLACK, "sans", 4, f"{soc}%", 545, 240, 800, 2)]
+
+
+def draw_days(days):
+    """The daily forecast: weekday, low, high and chance of rain."""
+    forecast_start_y = 330
+    forecast_offset_y = 60
+    commands = []
+    for i, (day_of_week, low, high, rain) in enumerate(days):
+        y = forecast_start_y + (forecast_offset_y * i)
+        commands.append(text(BLACK, "serif", 6, day_of_week, 0, y, 800, 2))
+        commands.append(text(BLUE, "serif", 4, f"{low:.1f}c {high:.1f}c {rain}%", 140, y, 800, 2, 0, 1))
+    return commands
+
+
+def remote_weather(REMOTE_LOCATIONS, fetch=True, force=False):
+    """Fetch and display the weather for multiple locations; fetch=False draws from the caches."""
+    locations = config.locations()
+    known_locations = []
+    for location in REMOTE_LOCATIONS:
+        if location in locations:
+            known_locations.append(location)
+        else:
+            print(f"Location {location} not found in the locations dictionary.")
+
+    infos = [locations[location] for location in known_locations]
+    if fetch:
+        # One request for every uncached location, asking only for the daily min/max shown below
+        results, soc = run_async(weather_for(infos, WEATHER_DAILY)), get_soc()
+    else:
+        results, soc = [cached_forecast(info) for info in infos], inverter.soc
+
+    rows = []
+    oldest = None
+    now = unix_time()
+    for location, forecast in zip(known_locations, results):
+        today = forecast.next_days(now, 1) if forecast else None
+        if not today:
+            debug_print("Skipping " + location + ", do not have weather data")
+            continue
+        _, min_temp, max_temp, _ = today[0]
+        rows.append((locations[location][2], min_temp, max_temp))
+        fetched_at = forecast_fetched_at(locations[location])
+        if fetched_at is not None and (oldest is None or fetched_at < oldest):
+            oldest = fetched_at
+
+    state = (tuple(rows), soc, LOCAL_CURR_TEMP, age_label(oldest, WEATHER_CACHE_TTL))
+    render_screen(remote_layout, state, remote_values, force)
+    return 1
+
+
+def remote_values(state):
+    """Slot values for the remote weather screen from its render state."""
+    rows, soc, temperature, age = state
+    values = header_values(temperature, age)
+    values.update({'locations': rows, 'soc': soc})
+    return values
+
+
+def draw_remote_rows(rows):
+    """Each remote location's low and high, from the bottom of the screen up."""
+    y_position = 453  # Starting Y position for displaying weather
+    commands = []
+    for short_name, min_temp, max_temp in rows:
+        commands.append(text(BLACK, "serif", 6, f"{short_name}: {min_temp:.1f}c {max_temp:.1f}c", 0, y_position, 800, 2))
+        y_position -= 75  # Move up for the next location
+    return commands
+
+
+def draw_batt(soc):
+    """The battery gauge's fill, pointer and percentage for a state of charge."""
+    commands = []
+    if soc >= 80:
+        commands += [rectangle(GREEN, 720, 130 + i * 60, 80, 50, z=1) for i in range(6)]
+    empty_sqrs = max(0, 6 - round(soc / 16.6))
+    commands += [rectangle(WHITE, 730, 130 + i * 60, 60, 40, z=2) for i in range(empty_sqrs)]
+
+    # Display percentage and battery level indicator
+    CURR_TRI_Y = 490 - round(soc * 3.5) + 10
+    commands.append(triangle(BLACK, 690, CURR_TRI_Y - 40, 690, CURR_TRI_Y, 718, CURR_TRI_Y - 20, z=3))
+    text_y = CURR_TRI_Y - 60 if soc < 45 else CURR_TRI_Y + 30
+    commands.append(text(BLACK, "sans", 4, f"{soc}%" if soc < 100 else "Full", 585, text_y, 800, 2, z=3))
+    return commands
+
+
+# Screen layouts
+# Each screen's fixed labels and outlines are compiled once here; the slots
+# hold what changes, inside boxes that don't overlap (see display_list).
+BATTERY_SLOT = Slot('soc', (580, 62, 220, 418), draw_batt, WHITE, [
+    text(BLACK, "sans", 4, 'Batt', 730, 105, 800, 1),
+] + [rectangle(BLACK, 720, 130 + i * 60, 80, 50) for i in range(6)])
+
+usage_layout = Layout("usage", HEADER_CHROME + [
+    text(BLACK, "sans", 4, title, 0, 153 + i * 100, 800, 2) for i, title in enumerate(['Pv:', 'Ld:', 'Bt:', 'Gr:'])
+], HEADER_SLOTS + [
+    Slot('pv', (105, 87, 250, 70), draw_pv, WHITE),
+    Slot('load', (105, 187, 250, 70), draw_load, WHITE),
+    Slot('battery_power', (105, 291, 250, 70), draw_battery_power, WHITE),
+    Slot('grid', (105, 395, 250, 70), draw_grid, WHITE),
+] + [sparkline_slot(series, bottom) for series, bottom in enumerate([172, 272, 376, 480])] + [
+    Slot('plants', (355, 65, 225, 415), draw_plant_rows, WHITE),
+    BATTERY_SLOT,
+])
+
+weather_layout = Layout("weather", HEADER_CHROME + [
+    text(BLACK, "sans", 4, "Battery", 545, 190, 800, 1),
+    line(BLACK, 0, 280, 190, 280, 4),
+    text(BLACK, "sans", 4, "Low       High     Rain", 230, 280, 800, 1),
+], HEADER_SLOTS + [
+    Slot('hours', (0, 62, 525, 200), draw_hours, WHITE),
+    Slot('name', (525, 62, 275, 110), draw_location_name, WHITE),
+    Slot('soc', (540, 210, 260, 60), draw_weather_soc, WHITE),
+    Slot('days', (0, 300, 800, 180), draw_days, WHITE),
+])
+
+remote_layout = Layout("remote", HEADER_CHROME, HEADER_SLOTS + [
+    Slot('locations', (0, 62, 580, 418), draw_remote_rows, WHITE),
+    BATTERY_SLOT,
+])
@@ -0,0 +1,235 @@
+"""Benchmarks sun_sync.py's screens and update() cycles on the host.
+
+    python3 sim/bench.py [--cycles 15] [--latency 0.2] [--fail /flow=500] [--press B@40] [--heap] [--calls]
+                         [--verbose]
+    python3 sim/bench.py --deep-sleep 6 [--latency 0.2] [--fail /flow=500] [--verbose]
+
+Logs in, shows each screen once from cold, then runs update() for --cycles
+rotations through the screens with the clock moving on UPDATE_INTERVAL per
+screen. For each step it reports the requests made, bytes sent and
+received, connections opened (TLS handshakes on the board), wall time,
+draw calls and panel refreshes. --fail PATTERN=STATUS answers requests whose
+URL contains PATTERN with STATUS, or drops the connection for STATUS=drop.
+--press BUTTON@READS presses button A, B or C during the update() cycles on
+its READS-th poll, and reports what the screen it asked for cost. --calls
+breaks the draw calls down by PicoGraphics method.
+
+--deep-sleep WAKES runs SCHEDULER_MODE = "deep_sleep" instead: each wake is
+a fresh process sharing one flash directory, calling deep_sleep_update()
+with a FakeBackend, with the clock moved on by the alarms set so far. It
+reports what each wake cost and checks that the screens rotate, every alarm
+is within MIN_UPDATE_INTERVAL and MAX_UPDATE_INTERVAL, and every wake after
+the first restores the data saved in /state.json."""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import harness  # noqa: E402
+
+COLUMNS = ("requests", "KB in", "KB out", "handshakes", "wall ms", "draw calls", "refreshes")
+
+
+def counters():
+    import picographics
+    import uasyncio
+    return {
+        'requests': harness.server.stats['requests'],
+        'KB in': harness.server.stats['bytes_out'] / 1024,
+        'KB out': harness.server.stats['bytes_in'] / 1024,
+        'handshakes': sum(uasyncio.connections.values()),
+        'wall ms': time.perf_counter() * 1000,
+        'draw calls': sum(picographics.calls.values()),
+        'refreshes': picographics.updates,
+    }
+
+
+def measure(name, func, verbose, per=1):
+    """Run func, returning a table row of what it cost (divided by per)."""
+    before = counters()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(sys.stdout if verbose else output):
+        func()
+    after = counters()
+    return [name] + [(after[column] - before[column]) / per for column in COLUMNS]
+
+
+def watch_presses(sun_sync, presses):
+    """Press buttons during update() as scripted; returns a list filled with a line per screen shown for one."""
+    import inky_helper
+    import picographics
+    for spec in presses:
+        letter, _, reads = spec.partition("@")
+        getattr(inky_helper.inky_frame, f"button_{letter.lower()}").press(int(reads))
+    shown = []
+    show_screen = sun_sync.show_screen
+
+    def watched(index, force=False):
+        before = harness.server.stats['requests'], picographics.updates, time.perf_counter()
+        show_screen(index, force)
+        if force:
+            requests, updates, start = before
+            shown.append(f"Button for the {sun_sync.LOOP_SCREENS[index][0]} screen: "
+                         f"{harness.server.stats['requests'] - requests} requests, "
+                         f"{picographics.updates - updates} refreshes, {(time.perf_counter() - start) * 1000:.1f} ms")
+    sun_sync.show_screen = watched
+    return shown
+
+
+def wake(args):
+    """Run one deep sleep wake in this process and print what it did as a JSON line."""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else output):
+        sun_sync = harness.load(args.latency, failures_from(args.fail), args.wake)
+    harness.slept[0] = args.clock
+    from sleep_scheduler import FakeBackend, PowerCut
+    backend = FakeBackend()
+    restored = []
+    restore_cached_data = sun_sync.restore_cached_data
+
+    def watched_restore(saved):
+        restored.append(bool(saved.get('inverter') and saved.get('weather')))
+        restore_cached_data(saved)
+    sun_sync.restore_cached_data = watched_restore
+    shown = [name for name, _ in sun_sync.SCREENS]
+    before = counters()
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else output):
+        try:
+            sun_sync.deep_sleep_update(backend)
+        except PowerCut:
+            pass
+    after = counters()
+    screen = [line for line in output.getvalue().splitlines() if line.startswith("Showing ")]
+    print(json.dumps({
+        'screen': screen[0].split()[1] if screen else None,
+        'alarms': backend.alarms,
+        'restored': any(restored),
+        'limits': [sun_sync.config.MIN_UPDATE_INTERVAL, sun_sync.config.MAX_UPDATE_INTERVAL],
+        'screens': shown,
+        'row': [(after[column] - before[column]) for column in COLUMNS],
+    }))
+
+
+def deep_sleep(args):
+    """Run --deep-sleep wakes, each in its own process, and check the schedule they follow."""
+    flash = tempfile.mkdtemp(prefix="inky-flash-")
+    clock = 0
+    rows = []
+    problems = []
+    for i in range(args.deep_sleep):
+        command = [sys.executable, os.path.abspath(__file__), "--wake", flash, "--clock", str(clock),
+                   "--latency", str(args.latency)] + [f"--fail={spec}" for spec in args.fail]
+        if args.verbose:
+            command.append("--verbose")
+        result = subprocess.run(command, capture_output=True, text=True)
+        if args.verbose:
+            print(result.stdout, end="")
+        lines = result.stdout.strip().splitlines()
+        if result.returncode or not lines:
+            print(result.stderr, end="")
+            sys.exit(f"Wake {i + 1} failed")
+        woke = json.loads(lines[-1])
+        expected = woke['screens'][i % len(woke['screens'])]
+        if woke['screen'] != expected:
+            problems.append(f"wake {i + 1} showed {woke['screen']}, expected {expected}")
+        if len(woke['alarms']) != 1:
+            problems.append(f"wake {i + 1} set {len(woke['alarms'])} alarms")
+        low, high = woke['limits']
+        for seconds in woke['alarms']:
+            if not low <= seconds <= high:
+                problems.append(f"wake {i + 1} slept {seconds} seconds, outside {low}-{high}")
+        if i and not woke['restored']:
+            problems.append(f"wake {i + 1} didn't restore /state.json")
+        clock += sum(woke['alarms'])
+        rows.append([f"wake {i + 1} {woke['screen']}, sleep {sum(woke['alarms'])}s"] + woke['row'])
+    print_table(rows)
+    print("Deep sleep: " + ("; ".join(problems) if problems else
+                            f"{args.deep_sleep} wakes rotated through the screens, "
+                            "alarms within the interval bounds, state restored on each wake"))
+    if problems:
+        sys.exit(1)
+
+
+def failures_from(specs):
+    """Parse --fail PATTERN=STATUS specs into StubServer failures."""
+    failures = {}
+    for spec in specs:
+        pattern, _, status = spec.rpartition("=")
+        failures[pattern] = status if status == "drop" else int(status)
+    return failures
+
+
+def print_table(rows):
+    width = max(len(row[0]) for row in rows)
+    print(f"{'':{width}}  " + "  ".join(f"{column:>10}" for column in COLUMNS))
+    for row in rows:
+        print(f"{row[0]:{width}}  " + "  ".join(f"{value:>10.1f}" for value in row[1:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cycles", type=int, default=15, help="update() rotations through the screens")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response")
+    parser.add_argument("--fail", action="append", default=[], metavar="PATTERN=STATUS",
+                        help="inject failures for URLs containing PATTERN")
+    parser.add_argument("--press", action="append", default=[], metavar="BUTTON@READS",
+                        help="press a button during the update() cycles")
+    parser.add_argument("--heap", action="store_true", help="trace Python heap use for gc.mem_alloc()")
+    parser.add_argument("--calls", action="store_true", help="count draw calls per PicoGraphics method")
+    parser.add_argument("--deep-sleep", type=int, default=0, metavar="WAKES",
+                        help="run this many deep sleep wakes instead of update() cycles")
+    parser.add_argument("--verbose", action="store_true", help="show sun_sync's own output")
+    # One wake of --deep-sleep, run by it in a new process
+    parser.add_argument("--wake", help=argparse.SUPPRESS)
+    parser.add_argument("--clock", type=float, default=0.0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.wake:
+        wake(args)
+        return
+    if args.deep_sleep:
+        deep_sleep(args)
+        return
+    failures = failures_from(args.fail)
+    if args.heap:
+        tracemalloc.start()
+
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+        sun_sync = harness.load(args.latency, failures)
+    # Nothing should be set up until it is first used
+    devices = sorted(sun_sync.hardware._devices)
+    print(f"Import: {harness.import_ms:.0f} ms, hardware set up: {', '.join(devices) or 'none'}")
+
+    rows = [
+        measure("login", sun_sync.my_bearer_token, args.verbose),
+        measure("my_current_usage", sun_sync.my_current_usage, args.verbose),
+        measure("my_current_weather", lambda: sun_sync.my_current_weather(sun_sync.config.local_location()),
+                args.verbose),
+        measure("remote_weather", lambda: sun_sync.remote_weather(sun_sync.config.locations()['ListOrder']),
+                args.verbose),
+    ]
+    shown = watch_presses(sun_sync, args.press)
+    if args.cycles:
+        rows.append(measure("update() per cycle", lambda: harness.run_cycles(sun_sync, args.cycles),
+                            args.verbose, args.cycles))
+    print_table(rows)
+    for line in shown:
+        print(line)
+    if args.heap:
+        current, peak = tracemalloc.get_traced_memory()
+        print(f"Python heap: {current / 1024:.1f} KB now, {peak / 1024:.1f} KB peak")
+    if args.calls:
+        import picographics
+        print("Draw calls: " + ", ".join(f"{name} {count}" for name, count in sorted(picographics.calls.items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Checks Forecast's local time labels around DST changes against zoneinfo.
+
+    python3 sim/dst_check.py [--years 2026 2027] [--verbose]
+
+Open-Meteo sends each day's local midnight and the UTC offset at the time
+of the request, but not when a DST change happens, so Forecast.dst_change()
+assumes the usual rules. For each zone in ZONES and each DST change in the
+given years, forecasts are built as Open-Meteo would send them, starting
+up to three days before the change and requested at every hour of their
+first day. Every hour of each forecast up to its last day is then checked
+(a forecast can't show whether its last day is a change day): Forecast.clock()
+against the local time zoneinfo gives, and Forecast.local_day() against the
+local date. Exits with status 1 on any mismatch, so a change to
+offset_at(), dst_change() or day0 that breaks the labels shows up here."""
+
+import argparse
+import datetime
+import os
+import sys
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import harness  # noqa: E402
+
+sys.path[:0] = [os.path.join(harness.SIM_DIR, "stubs"), harness.REPO_DIR]
+from weather import Forecast  # noqa: E402
+
+# Zones for each of dst_change()'s rules: Europe, the Americas, and Australia and New Zealand
+ZONES = ["Europe/London", "Europe/Lisbon", "Europe/Berlin", "Europe/Helsinki", "America/New_York",
+         "America/Chicago", "America/Denver", "America/Los_Angeles", "Australia/Sydney", "Australia/Adelaide",
+         "Pacific/Auckland"]
+FORECAST_DAYS = 5
+EPOCH_DAY = datetime.date(1970, 1, 1).toordinal()
+
+
+def midnight(zone, day):
+    """Unix time of a date's local midnight in a zone."""
+    return int(datetime.datetime.combine(day, datetime.time(), zone).timestamp())
+
+
+def change_days(zone, year):
+    """The dates in a year that aren't 24 hours long in a zone."""
+    day = datetime.date(year, 1, 1)
+    while day.year == year:
+        following = day + datetime.timedelta(days=1)
+        if midnight(zone, following) - midnight(zone, day) != 86400:
+            yield day
+        day = following
+
+
+def forecast(zone, start, now):
+    """A Forecast for FORECAST_DAYS days from `start`, as Open-Meteo would send it at Unix time `now`."""
+    return Forecast({
+        'utc_offset_seconds': int(datetime.datetime.fromtimestamp(now, zone).utcoffset().total_seconds()),
+        'hourly': {'time': [now // 3600 * 3600]},
+        'daily': {'time': [midnight(zone, start + datetime.timedelta(days=i)) for i in range(FORECAST_DAYS)]},
+    })
+
+
+def mismatches(zone, start, now):
+    """Yield a line for each hour of the forecast requested at `now` labelled differently from zoneinfo."""
+    f = forecast(zone, start, now)
+    end = midnight(zone, start + datetime.timedelta(days=FORECAST_DAYS - 1))
+    for t in range(midnight(zone, start), end, 3600):
+        local = datetime.datetime.fromtimestamp(t, zone)
+        expected = (local.strftime("%H:%M"), local.date().toordinal() - EPOCH_DAY)
+        got = (f.clock(t), f.local_day(t))
+        if got != expected:
+            yield f"{zone.key}: forecast from {start} at {f.clock(now)}: {local.isoformat()} labelled {got}, " \
+                  f"expected {expected}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    this_year = datetime.date.today().year
+    parser.add_argument("--years", type=int, nargs="+", default=[this_year, this_year + 1],
+                        help="years whose DST changes are checked")
+    parser.add_argument("--verbose", action="store_true", help="list every change checked")
+    args = parser.parse_args()
+
+    changes = forecasts = 0
+    failures = []
+    for name in ZONES:
+        zone = ZoneInfo(name)
+        for year in args.years:
+            for day in change_days(zone, year):
+                changes += 1
+                if args.verbose:
+                    print(f"{name}: {day}")
+                for before in range(FORECAST_DAYS - 1):
+                    start = day - datetime.timedelta(days=before)
+                    first = midnight(zone, start)
+                    for now in range(first, midnight(zone, start + datetime.timedelta(days=1)), 3600):
+                        forecasts += 1
+                        failures.extend(mismatches(zone, start, now))
+
+    for line in failures:
+        print(line)
+    print(f"DST labels: {changes} changes in {len(ZONES)} zones, {forecasts} forecasts, "
+          f"{len(failures)} hours labelled wrongly")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Runs sun_sync.py under CPython, off the Inky Frame.
+
+The stand-in modules in sim/stubs replace the board's drivers, the
+MicroPython additions to time and gc are filled in, files at the root of the
+board's flash go to a temporary directory, and every HTTPS request is served
+by a local StubServer (see server.py):
+
+    import harness
+    sun_sync = harness.load(latency=0.05)
+    sun_sync.my_current_usage()
+
+Importing sun_sync sets up no hardware, so harness.import_ms is the time
+the import itself took.
+
+time.sleep() and uasyncio.sleep() return at once but move the clock on, so
+update() doesn't wait out UPDATE_INTERVAL yet caches still expire as they
+would on the board; run_cycles() runs it for a number of screen rotations."""
+
+import builtins
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SIM_DIR)
+PICO_HEAP = 192 * 1024  # bytes of heap a Pico W has free after boot, for gc.mem_free()
+
+flash_dir = None
+server = None
+import_ms = None  # ms taken to import sun_sync and every module it imports
+slept = [0.0]  # seconds of time.sleep() requested, added to time.time()
+
+
+class StopCycles(Exception):
+    """Raised at the start of a cycle to end update() after the requested cycles."""
+
+
+def _flash_path(path):
+    # Files at the root of the board's flash, e.g. /token.json
+    if isinstance(path, str) and path.startswith("/") and os.path.dirname(path) == "/":
+        return os.path.join(flash_dir, path[1:])
+    return path
+
+
+def _redirect_flash():
+    real_open = builtins.open
+    builtins.open = lambda path, *args, **kwargs: real_open(_flash_path(path), *args, **kwargs)
+    for name in ("stat", "remove"):
+        real = getattr(os, name)
+        setattr(os, name, lambda path, *args, real=real: real(_flash_path(path), *args))
+    real_rename = os.rename
+    os.rename = lambda old, new: real_rename(_flash_path(old), _flash_path(new))
+
+
+def _add_micropython_apis():
+    start = time.monotonic()
+    time.ticks_ms = lambda: int((time.monotonic() - start) * 1000) & 0x3FFFFFFF
+    time.ticks_us = lambda: int((time.monotonic() - start) * 1000000) & 0x3FFFFFFF
+    time.ticks_add = lambda ticks, delta: (ticks + delta) & 0x3FFFFFFF
+    time.ticks_diff = lambda end, begin: ((end - begin + 0x20000000) & 0x3FFFFFFF) - 0x20000000
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+
+    import uasyncio
+    real_time = time.time
+    time.time = lambda: real_time() + slept[0] + uasyncio.slept[0]
+
+    def sleep(seconds):
+        slept[0] += seconds
+    time.sleep = sleep
+
+    # Python heap use when tracemalloc is running, otherwise nothing
+    def mem_alloc():
+        return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+    gc.mem_alloc = mem_alloc
+    gc.mem_free = lambda: PICO_HEAP - mem_alloc()
+
+
+def load(latency=0.0, failures=None, flash=None):
+    """Import sun_sync against the stubs and a fresh StubServer, and return it.
+
+    flash is the directory standing in for the board's flash; a new
+    temporary one is used if it is None. Only one sun_sync can be loaded per
+    process, as it keeps its state in module globals."""
+    global flash_dir, server, import_ms
+    sys.path[:0] = [os.path.join(SIM_DIR, "stubs"), SIM_DIR, REPO_DIR]
+    flash_dir = flash or tempfile.mkdtemp(prefix="inky-flash-")
+    os.chdir(flash_dir)
+    _redirect_flash()
+    _add_micropython_apis()
+
+    import uasyncio
+    from server import StubServer
+    server = uasyncio.get_event_loop().run_until_complete(StubServer(latency, failures).start())
+    uasyncio.server_port = server.port
+
+    start = time.perf_counter()
+    import sun_sync
+    import_ms = (time.perf_counter() - start) * 1000
+    return sun_sync
+
+
+def run_cycles(sun_sync, cycles):
+    """Run sun_sync.update() for this many rotations through its screens."""
+    cycles_left = [cycles]
+    housekeeping = sun_sync.housekeeping
+
+    # update() does its housekeeping at the start of every cycle
+    async def counting_housekeeping():
+        if cycles_left[0] == 0:
+            raise StopCycles()
+        cycles_left[0] -= 1
+        await housekeeping()
+    sun_sync.housekeeping = counting_housekeeping
+    try:
+        sun_sync.update()
+    except StopCycles:
+        pass
+    finally:
+        sun_sync.housekeeping = housekeeping
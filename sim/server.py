@@ -0,0 +1,189 @@
+"""Local HTTP/1.1 stub of the Sunsynk and Open-Meteo APIs.
+
+Sunsynk endpoints answer with the recordings in sim/recordings. Open-Meteo
+answers are generated from the query, since they have to follow the clock
+and the requested locations and fields.
+
+latency adds a delay before every response. failures maps a URL substring
+to an HTTP status to answer with instead, or to "drop" to close the
+connection without answering."""
+
+import asyncio
+import calendar
+import json
+import os
+import time
+from urllib.parse import parse_qs, urlsplit
+
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")
+CHUNKED_OVER = 2000  # bytes; larger bodies are sent chunked, like Open-Meteo does
+
+
+def recording(name):
+    with open(os.path.join(RECORDINGS_DIR, name + ".json")) as f:
+        return json.load(f)
+
+
+def meteo_location(query, latitude, longitude):
+    """One location's forecast, shaped like Open-Meteo's for the given query."""
+    unixtime = query.get("timeformat", [""])[0] == "unixtime"
+    days = int(query.get("forecast_days", ["7"])[0])
+    now = int(time.time())
+    midnight = now - now % 86400
+
+    def stamp(t, date_only=False):
+        if unixtime:
+            return t
+        return time.strftime("%Y-%m-%d" if date_only else "%Y-%m-%dT%H:%M", time.gmtime(t))
+
+    result = {"latitude": float(latitude), "longitude": float(longitude), "generationtime_ms": 0.1,
+              "utc_offset_seconds": 0, "timezone": "GMT", "timezone_abbreviation": "GMT", "elevation": 20.0}
+    if "current" in query:
+        current = {"time": stamp(now - now % 900), "interval": 900}
+        for field in query["current"][0].split(","):
+            current[field] = 17.3
+        result["current"] = current
+    if "hourly" in query:
+        if "forecast_hours" in query:
+            start, count = now - now % 3600, int(query["forecast_hours"][0])
+        else:
+            start, count = midnight, days * 24
+        hourly = {"time": [stamp(start + i * 3600) for i in range(count)]}
+        for field in query["hourly"][0].split(","):
+            hourly[field] = [round(10 + (i % 24) * 0.5, 1) if "temperature" in field else (i * 7) % 100
+                             for i in range(count)]
+        result["hourly"] = hourly
+    if "daily" in query:
+        daily = {"time": [stamp(midnight + i * 86400, True) for i in range(days)]}
+        for field in query["daily"][0].split(","):
+            if field in ("sunrise", "sunset"):
+                hour = 6 if field == "sunrise" else 19
+                daily[field] = [stamp(midnight + i * 86400 + hour * 3600) for i in range(days)]
+            elif "temperature" in field:
+                daily[field] = [round((8.5 if "min" in field else 19.2) + i, 1) for i in range(days)]
+            else:
+                daily[field] = [40 + i for i in range(days)]
+        result["daily"] = daily
+    return result
+
+
+def sunsynk_day(date):
+    """A plant's day chart, shaped like Sunsynk's, with a point every 5 minutes up to now."""
+    midnight = calendar.timegm(time.strptime(date, "%Y-%m-%d"))
+    count = min(max((int(time.time()) - midnight) // 300 + 1, 0), 288)
+    infos = []
+    for label, unit, value in (("PV", "W", lambda m: max(0, 3000 - abs(m - 780) * 6)),
+                               ("Battery", "W", lambda m: 800 - m % 1600),
+                               ("SOC", "%", lambda m: 20 + m % 80),
+                               ("Load", "W", lambda m: 400 + m % 700),
+                               ("Grid", "W", lambda m: m % 300 - 100)):
+        records = [{"time": f"{i // 12:02d}:{i % 12 * 5:02d}", "value": str(value(i * 5)), "updateTime": None}
+                   for i in range(count)]
+        infos.append({"unit": unit, "records": records, "id": None, "label": label})
+    return {"code": 0, "msg": "Success", "data": {"unit": "W", "infos": infos}, "success": True}
+
+
+class StubServer:
+    """Serves canned API responses on 127.0.0.1, routing on the Host header."""
+
+    def __init__(self, latency=0.0, failures=None):
+        self.latency = latency
+        self.failures = failures or {}
+        self.log = []  # (method, host + path) of every request
+        self.stats = {'requests': 0, 'bytes_in': 0, 'bytes_out': 0}
+        self.tokens_issued = 0
+        self.port = None
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    def reset_stats(self):
+        self.log.clear()
+        for name in self.stats:
+            self.stats[name] = 0
+
+    def route(self, method, host, target, body):
+        """Return (status, JSON body) for a request, or (None, None) to drop the connection."""
+        url = f"https://{host}{target}"
+        for pattern, status in self.failures.items():
+            if pattern in url:
+                return (None, None) if status == "drop" else (status, {"code": status, "msg": "Injected failure"})
+
+        path = urlsplit(target).path
+        query = parse_qs(urlsplit(target).query)
+        if host == "api.open-meteo.com":
+            latitudes = query["latitude"][0].split(",")
+            longitudes = query["longitude"][0].split(",")
+            forecasts = [meteo_location(query, lat, lon) for lat, lon in zip(latitudes, longitudes)]
+            return 200, forecasts if len(forecasts) > 1 else forecasts[0]
+        if path == "/oauth/token":
+            self.tokens_issued += 1
+            return 200, {"code": 0, "msg": "Success", "data": {
+                "access_token": f"simulated-token-{self.tokens_issued}", "token_type": "bearer",
+                "refresh_token": "simulated-refresh", "expires_in": 604799, "scope": "all"}}
+        if path == "/api/v1/plants":
+            return 200, recording("plants")
+        if path.startswith("/api/v1/plant/energy/") and path.endswith("/flow"):
+            return 200, recording("flow")
+        if path.startswith("/api/v1/plant/energy/") and path.endswith("/day"):
+            return 200, sunsynk_day(query["date"][0])
+        for name in ("battery", "grid", "load"):
+            if path.startswith(f"/api/v1/inverter/{name}/"):
+                return 200, recording(name)
+        return 404, {"code": 404, "msg": "Not found"}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                received = len(request_line)
+                while True:
+                    line = await reader.readline()
+                    received += len(line)
+                    if line in (b"\r\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                host = headers.get("host", "")
+                self.log.append((method, host + urlsplit(target).path))
+                self.stats['requests'] += 1
+                self.stats['bytes_in'] += received + len(body)
+
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                status, payload = self.route(method, host, target, body)
+                if status is None:
+                    break
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(self.encode(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def encode(self, status, payload, keep_alive):
+        data = json.dumps(payload).encode()
+        head = (f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n")
+        if len(data) > CHUNKED_OVER:
+            out = (head + "Transfer-Encoding: chunked\r\n\r\n").encode()
+            for i in range(0, len(data), 1400):
+                chunk = data[i:i + 1400]
+                out += b"%x\r\n" % len(chunk) + chunk + b"\r\n"
+            out += b"0\r\n\r\n"
+        else:
+            out = (head + f"Content-Length: {len(data)}\r\n\r\n").encode() + data
+        self.stats['bytes_out'] += len(out)
+        return out
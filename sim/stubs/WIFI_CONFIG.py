@@ -0,0 +1,3 @@
+SSID = "simulator"
+PSK = "simulator"
+COUNTRY = "GB"
@@ -0,0 +1,61 @@
+"""Stand-in for Pimoroni's inky_helper.
+
+Presses are scripted with press(): inky_frame.button_b.press(40) makes
+button B read as pressed on its 40th read from now, which with the 50 ms
+button poll is about two seconds of the frame's time."""
+
+import os
+
+
+class _LED:
+    def on(self):
+        pass
+
+    def off(self):
+        pass
+
+
+class _Button:
+    def __init__(self):
+        self.reads = 0
+        self.presses = set()  # values of reads at which the button is down
+        self.lit = False
+
+    def press(self, after=1):
+        """Hold the button down for one read, `after` reads from now."""
+        self.presses.add(self.reads + after)
+
+    def led_on(self):
+        self.lit = True
+
+    def led_off(self):
+        self.lit = False
+
+    def read(self):
+        self.reads += 1
+        return self.reads in self.presses
+
+
+class _InkyFrame:
+    button_a = _Button()
+    button_b = _Button()
+    button_c = _Button()
+    button_d = _Button()
+    button_e = _Button()
+
+
+inky_frame = _InkyFrame()
+led_warn = _LED()
+
+
+def clear_button_leds():
+    for button in (inky_frame.button_a, inky_frame.button_b, inky_frame.button_c, inky_frame.button_d,
+                   inky_frame.button_e):
+        button.led_off()
+
+
+def file_exists(filename):
+    try:
+        return (os.stat(filename)[0] & 0x4000) == 0
+    except OSError:
+        return False
@@ -0,0 +1,49 @@
+"""Stand-in for MicroPython's machine module."""
+
+import time
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 2
+    PULL_DOWN = 3
+    IRQ_RISING = 4
+    IRQ_FALLING = 8
+
+    def __init__(self, pin, mode=IN, pull=None, value=None):
+        self.pin = pin
+        self.mode = mode
+        self.level = value or 0
+
+    def init(self, mode=IN, pull=None, value=None):
+        self.mode = mode
+
+    def value(self, level=None):
+        if level is None:
+            return self.level
+        self.level = int(level)
+
+    def on(self):
+        self.level = 1
+
+    def off(self):
+        self.level = 0
+
+
+class RTC:
+    """Reads the host clock; setting it is ignored."""
+
+    def datetime(self, timestamp=None):
+        if timestamp is not None:
+            return
+        t = time.gmtime(time.time())
+        return (t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0)
+
+
+def reset():
+    raise SystemExit("machine.reset()")
+
+
+def deepsleep(ms=0):
+    raise SystemExit("machine.deepsleep()")
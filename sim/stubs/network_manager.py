@@ -0,0 +1,25 @@
+"""Stand-in for Pimoroni's network_manager; connecting always succeeds at once."""
+
+connects = 0
+
+
+class NetworkManager:
+    def __init__(self, country="GB", client_timeout=30, access_point_timeout=5, status_handler=None, error_handler=None):
+        self.connected = False
+        self.status_handler = status_handler
+
+    async def client(self, ssid, psk):
+        global connects
+        connects += 1
+        self.connected = True
+        if self.status_handler:
+            self.status_handler("STA", True, self.ifaddress())
+
+    def isconnected(self):
+        return self.connected
+
+    def disconnect(self):
+        self.connected = False
+
+    def ifaddress(self):
+        return "127.0.0.1"
@@ -0,0 +1,38 @@
+"""Stand-in for the Inky Frame's PCF85063A RTC; reads the host clock and records timers."""
+
+import time
+
+
+class PCF85063A:
+    TIMER_TICK_4096HZ = 0
+    TIMER_TICK_64HZ = 1
+    TIMER_TICK_1HZ = 2
+    TIMER_TICK_1_OVER_60HZ = 3
+
+    def __init__(self, i2c):
+        self.i2c = i2c
+        self.timer = None  # (ticks, ttp) of the last set_timer()
+
+    def datetime(self, timestamp=None):
+        if timestamp is not None:
+            return
+        t = time.gmtime(time.time())
+        return (t[0], t[1], t[2], t[3], t[4], t[5], (t[6] + 1) % 7)
+
+    def set_timer(self, ticks, ttp=TIMER_TICK_1HZ):
+        self.timer = (ticks, ttp)
+
+    def enable_timer_interrupt(self, enable, clear=False):
+        pass
+
+    def clear_timer_flag(self):
+        pass
+
+    def read_timer_flag(self):
+        return False
+
+    def clear_alarm_flag(self):
+        pass
+
+    def read_alarm_flag(self):
+        return False
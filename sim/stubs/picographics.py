@@ -0,0 +1,27 @@
+"""Stand-in for Pimoroni's picographics that counts draw calls instead of drawing."""
+
+DISPLAY_INKY_FRAME_7 = 7
+
+calls = {}  # method name -> times called
+updates = 0  # panel refreshes
+
+
+class PicoGraphics:
+    def __init__(self, display):
+        self.display = display
+
+    def get_bounds(self):
+        return (800, 480)
+
+    def measure_text(self, text, scale=2, spacing=1):
+        calls['measure_text'] = calls.get('measure_text', 0) + 1
+        return len(text) * 6 * scale
+
+    def update(self):
+        global updates
+        updates += 1
+
+    def __getattr__(self, name):
+        def draw(*args, **kwargs):
+            calls[name] = calls.get(name, 0) + 1
+        return draw
@@ -0,0 +1,7 @@
+"""Stand-in for Pimoroni's I2C driver."""
+
+
+class PimoroniI2C:
+    def __init__(self, sda, scl, freq=400000):
+        self.sda = sda
+        self.scl = scl
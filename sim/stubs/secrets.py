@@ -0,0 +1,3 @@
+SUN_EMAIL = "simulator@example.com"
+SUN_PW = "simulator"
+SUN_SERIAL = "2207100000"
@@ -0,0 +1,34 @@
+"""Stand-in for MicroPython's uasyncio on top of asyncio.
+
+open_connection() ignores the requested host and TLS and connects to the
+simulator's local HTTP stub instead (see harness.py). The stub routes on the
+Host header, so requests behave as if they had reached the real servers."""
+
+import asyncio
+from asyncio import *  # noqa: F401,F403
+
+server_port = None  # Set by the harness once the stub server is listening
+sleep_scale = 0  # uasyncio.sleep() waits this fraction of the requested time
+connections = {}  # host -> connections opened, each a TLS handshake on the device
+slept = [0.0]  # seconds of uasyncio.sleep() requested
+
+_loop = asyncio.new_event_loop()
+asyncio.set_event_loop(_loop)
+
+
+def get_event_loop():
+    return _loop
+
+
+async def sleep(seconds):
+    slept[0] += seconds
+    await asyncio.sleep(seconds * sleep_scale)
+
+
+async def sleep_ms(ms):
+    await sleep(ms / 1000)
+
+
+async def open_connection(host, port, ssl=False):
+    connections[host] = connections.get(host, 0) + 1
+    return await asyncio.open_connection("127.0.0.1", server_port)
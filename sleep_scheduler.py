@@ -0,0 +1,127 @@
+"""Deep-sleep screen scheduler for the Inky Frame.
+
+Rather than keeping the board awake between screens, each power-up shows
+one screen, saves which screen comes next (plus any cached data) to flash,
+sets an RTC alarm and releases the vsys hold so the board powers off. The
+alarm powers it back on, the script starts from the top and the scheduler
+resumes at the saved screen.
+
+The hardware is reached only through a backend object, so the state
+machine runs on the host with FakeBackend in place of the RTC and pin."""
+
+import json
+import os
+import time
+
+
+class PowerCut(Exception):
+    """Raised by FakeBackend.sleep() where the real board would lose power."""
+
+
+class HardwareBackend:
+    """Sleeps using the PCF85063A timer and the vsys hold pin."""
+
+    def __init__(self, rtc, hold_vsys_en_pin):
+        self.rtc = rtc
+        self.hold_vsys_en_pin = hold_vsys_en_pin
+
+    def sleep(self, seconds):
+        """Set the wake alarm and cut power; returns after `seconds` on USB power."""
+        self.rtc.clear_timer_flag()
+        # The timer counts to 255 at most, so long sleeps count minutes
+        if seconds <= 255:
+            self.rtc.set_timer(seconds, ttp=self.rtc.TIMER_TICK_1HZ)
+        else:
+            self.rtc.set_timer(min((seconds + 59) // 60, 255), ttp=self.rtc.TIMER_TICK_1_OVER_60HZ)
+        self.rtc.enable_timer_interrupt(True)
+
+        # Releasing the hold powers the board off when running on battery
+        self.hold_vsys_en_pin.init(self.hold_vsys_en_pin.IN)
+
+        # On USB power we are still running, so wait out the interval here
+        time.sleep(seconds)
+        self.hold_vsys_en_pin.init(self.hold_vsys_en_pin.OUT)
+        self.hold_vsys_en_pin.value(True)
+        self.rtc.clear_timer_flag()
+
+
+class FakeBackend:
+    """Records alarms and power cuts instead of touching hardware, for host testing.
+
+    With on_battery=True, sleep() raises PowerCut like the board losing
+    power; otherwise it returns as the board does on USB power."""
+
+    def __init__(self, on_battery=True):
+        self.on_battery = on_battery
+        self.alarms = []  # Seconds requested for each sleep
+        self.power_cuts = 0
+
+    def sleep(self, seconds):
+        self.alarms.append(seconds)
+        if self.on_battery:
+            self.power_cuts += 1
+            raise PowerCut()
+
+
+class SleepScheduler:
+    """Shows one screen per power-up and sleeps until the next is due.
+
+    screens is a list of (name, function) pairs shown in rotation.
+    interval is the seconds to sleep after each screen, or a function
+    returning them, called once the screen has been shown.
+    save_data() returns a JSON-serialisable dict of cached data to keep
+    across power cuts, and restore_data(dict) puts it back after a wake."""
+
+    def __init__(self, screens, backend, state_file, interval, save_data=None, restore_data=None):
+        self.screens = screens
+        self.backend = backend
+        self.state_file = state_file
+        self.interval = interval
+        self.save_data = save_data
+        self.restore_data = restore_data
+        self.state = {'screen': 0, 'cycles': 0, 'data': {}}
+
+    def load(self):
+        """Load the saved state, starting afresh if there is none or it is unreadable."""
+        try:
+            with open(self.state_file, "r") as f:
+                self.state.update(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"No saved scheduler state ({e}), starting at the first screen")
+        if self.restore_data and self.state['data']:
+            self.restore_data(self.state['data'])
+
+    def save(self):
+        """Write the state to a temporary file and rename it over the old one."""
+        if self.save_data:
+            self.state['data'] = self.save_data()
+        temp_file = self.state_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.state, f)
+        os.rename(temp_file, self.state_file)
+
+    def next_screen(self):
+        """Return the (name, function) pair due to be shown."""
+        return self.screens[self.state['screen'] % len(self.screens)]
+
+    def step(self):
+        """Show the due screen, save what comes next and go to sleep."""
+        name, show = self.next_screen()
+        print(f"Showing {name} screen")
+        try:
+            show()
+        except Exception as e:
+            # Still move on and sleep, rather than draining the battery retrying
+            print(f"{name} screen failed: {e}")
+        self.state['screen'] = (self.state['screen'] + 1) % len(self.screens)
+        if self.state['screen'] == 0:
+            self.state['cycles'] += 1
+        interval = self.interval() if callable(self.interval) else self.interval
+        self.save()
+        self.backend.sleep(interval)
+
+    def run(self):
+        """Resume from the saved state and keep stepping through screens."""
+        self.load()
+        while True:
+            self.step()
@@ -1,598 +1,474 @@
+"""Sunsynk inverter readings and Open-Meteo forecasts on a Pimoroni Inky Frame.
+
+This module schedules the screens and is the entry point: main() runs the
+screens in a loop or, with SCHEDULER_MODE = "deep_sleep", shows one per
+wake. The rest of the app is split into modules that can be imported
+without touching hardware or flash, and frozen into the firmware (see
+manifest.py):
+
+- config: settings, and the locations and credentials read from flash
+- hardware: the panel, buttons, RTC, WiFi and vsys hold pin, set up on first use
+- net: the WiFi link and the async HTTPS client
+- weather, sunsynk: the data sources, and their caches
+- screens: what each screen shows and drawing it"""
+
 import uasyncio
-import sys
-import json
 import gc
 import time
-import urequests as requests  # MicroPython's version of requests
-
-from network_manager import NetworkManager
-from picographics import PicoGraphics, DISPLAY_INKY_FRAME_7 as DISPLAY
-from machine import Pin, RTC
-from pimoroni_i2c import PimoroniI2C
-from pcf85063a import PCF85063A
-import WIFI_CONFIG
-import inky_helper as ih
-import ntptime
-
-# Constants
-I2C_SDA_PIN = 4
-I2C_SCL_PIN = 5
-HOLD_VSYS_EN_PIN = 2
-UPDATE_INTERVAL = 60  # 1 minute in seconds
-#UPDATE_INTERVAL = 1
-BLACK, WHITE, GREEN, BLUE, RED, YELLOW, ORANGE, TAUPE = range(8)
-DOW = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
-fDOW = ['DOW', 'Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat']
-LOCAL_CURR_TIME = "??:??"
-LOCAL_CURR_TEMP = "??"
-
-# Debug Mode
-DEBUG_MODE = False  # Set to False to disable debug output
-
-# Initialize display and other components
-graphics = PicoGraphics(DISPLAY)
-ih.clear_button_leds()
-ih.led_warn.off()
-
-# Initialize I2C and RTC
-i2c = PimoroniI2C(I2C_SDA_PIN, I2C_SCL_PIN, 100000)
-rtc = PCF85063A(i2c)
-
-# Enable vsys hold
-hold_vsys_en_pin = Pin(HOLD_VSYS_EN_PIN, Pin.OUT)
-hold_vsys_en_pin.value(True)
-
-# Load secrets
-my_user_email = ""
-my_user_password = ""
-my_sun_serial = ""
-try:
-    from secrets import SUN_EMAIL, SUN_PW, SUN_SERIAL
-    my_user_email = SUN_EMAIL
-    my_user_password = SUN_PW
-    my_sun_serial = SUN_SERIAL
-except ImportError:
-    print("Create a 'secrets.py' file with your SunSync credentials")
-    sys.exit(1)
-
-# Load locations from file or set default locations
-locations = {}
-if ih.file_exists("locations.json"):
-    with open("/locations.json", "r") as f:
-        locations = json.load(f)
-else:
-    locations = {
-        'Local': ['51.507351', '-0.127758', 'LON'],
-        'New York': ['40.712776', '-74.005974', 'NYC'],
-        'Singapore': ['1.352083', '103.819839', 'SGP'],
-        'Manchester': ['53.480759', '-2.242631', 'MAN'],
-        'Malmo': ['55.604980', '13.003822', 'MMX'],
-        'ListOrder': ['Manchester', 'Singapore', 'Malmo', 'New York', 'Local']
+
+import config
+import hardware
+from config import (SCHEDULER_MODE, STATE_FILE, PROFILING, PROFILE_FILE, BOOT_BUDGET_MS, LKG_FILE,
+                    LKG_WRITE_INTERVAL, UPDATE_INTERVAL, MIN_UPDATE_INTERVAL, MAX_UPDATE_INTERVAL,
+                    CHANGE_THRESHOLD, SHARP_CHANGE, PREFETCH_LEAD)
+from net import connection, connection_pool, run_async
+from weather import (WEATHER_DAILY, Forecast, weather_cache, weather_cache_stats, weather_cache_put, weather_for,
+                     cached_forecast, forecast_fresh, unix_time)
+from sunsynk import inverter, power_history, bearer_token, my_bearer_token, backfill_history
+import screens
+from screens import my_current_usage, my_current_weather, remote_weather, render_stats
+from sleep_scheduler import SleepScheduler, HardwareBackend
+from lkg_store import LastKnownGood
+import profiler
+from profiler import span
+
+profiler.enabled = PROFILING
+
+
+def save_cached_data():
+    """Cached data worth keeping across a deep sleep power cut."""
+    return {
+        'inverter': inverter.as_dict(),
+        'clock': connection.as_dict(),
+        'interval': poll_interval.as_dict(),
+        'weather': [[key[0], key[1], entry['detail'], entry['fetched_at'], entry['data'].as_dict()]
+                    for key, entry in weather_cache.items()],
+        'header': [screens.LOCAL_CURR_TIME, screens.LOCAL_CURR_TEMP]
     }
-    with open("/locations.json", "w") as f:
-        json.dump(locations, f)
 
-LOCAL_LOCATION = locations['Local']
 
-# Initialize network manager
-def status_handler(mode, status, ip):
-    """Handle network status updates."""
-    print(f"Mode: {mode}, Status: {status}, IP: {ip}")
+def restore_cached_data(saved):
+    """Put back data saved by save_cached_data() before the last power cut."""
+    inverter.restore(saved.get('inverter', {}))
+    connection.restore(saved.get('clock', {}))
+    poll_interval.restore(saved.get('interval', {}))
+    for latitude, longitude, detail, fetched_at, data in saved.get('weather', []):
+        forecast = Forecast(data)
+        weather_cache_put([latitude, longitude], detail, forecast, forecast.size())
+        weather_cache[(latitude, longitude)]['fetched_at'] = fetched_at
+    header = saved.get('header')
+    if header:
+        screens.LOCAL_CURR_TIME, screens.LOCAL_CURR_TEMP = header
+
+
+# Last known good data
+# The newest successful inverter snapshot and each cached forecast are kept
+# on flash in LKG_FILE, packed with their to_bytes() methods under the names
+# "inverter" and "wx:<lat>,<lon>". At power-on they are loaded back into the
+# snapshot and weather cache, so the first screen is drawn from them at once,
+# with its age in the header, while fresh data is fetched.
+last_known_good = LastKnownGood(LKG_FILE, LKG_WRITE_INTERVAL)
+
+
+def save_last_known_good():
+    """Note any newer data in the last known good store, writing it to flash if due."""
+    if inverter.fetched_at is not None and inverter.rows:
+        last_known_good.put("inverter", inverter.fetched_at, inverter.to_bytes())
+    names = set()
+    for (latitude, longitude), entry in weather_cache.items():
+        name = f"wx:{latitude},{longitude}"
+        names.add(name)
+        if entry['fetched_at'] > (last_known_good.timestamp(name) or 0):
+            last_known_good.put(name, entry['fetched_at'], bytes([entry['detail']]) + entry['data'].to_bytes())
+    # Forget forecasts the weather cache has evicted
+    for name in [name for name in last_known_good.records if name.startswith("wx:") and name not in names]:
+        last_known_good.discard(name)
+    if last_known_good.flush(time.time()):
+        print("Saved last known good data")
+
+
+def restore_last_known_good():
+    """Load the last known good data from flash; returns True if there were inverter readings."""
+    last_known_good.load()
+    restored = False
+    for name, (timestamp, payload) in last_known_good.records.items():
+        try:
+            if name == "inverter":
+                if inverter.fetched_at is None:
+                    inverter.restore_bytes(payload, timestamp)
+                    restored = True
+            elif name.startswith("wx:"):
+                latitude, longitude = name[3:].split(",")
+                if (latitude, longitude) not in weather_cache:
+                    forecast = Forecast.from_bytes(payload[1:])
+                    weather_cache_put([latitude, longitude], payload[0], forecast, forecast.size())
+                    weather_cache[(latitude, longitude)]['fetched_at'] = timestamp
+        except Exception as e:
+            print(f"Skipping unreadable last known good record {name}: {e}")
+    return restored
 
-network_manager = NetworkManager(WIFI_CONFIG.COUNTRY, status_handler=status_handler)
 
-# API Endpoints
-login_url = 'https://api.sunsynk.net/oauth/token'
-plant_id_endpoint = f'https://api.sunsynk.net/api/v1/plants?page=1&limit=10&name=&status='
-inverter_endpoint = f'https://api.sunsynk.net/api/v1/inverter/battery/{my_sun_serial}/realtime?sn={my_sun_serial}&lan=en'
-grid_endpoint = f'https://api.sunsynk.net/api/v1/inverter/grid/{my_sun_serial}/realtime?sn={my_sun_serial}'
-load_endpoint = f'https://api.sunsynk.net/api/v1/inverter/load/{my_sun_serial}/realtime?sn={my_sun_serial}'
+def update_clock_ntp():
+    """Update RTC with time from NTP server, if it is due a resync."""
+    run_async(sync_clock_if_due())
 
-def debug_print(message):
-    """Utility function to print debug messages when DEBUG_MODE is enabled."""
-    if DEBUG_MODE:
-        print(message)
 
-def retry_request(func, *args, **kwargs):
-    """Retry a request after 30 seconds if it fails."""
-    for _ in range(2):
-        try:
-            response = func(*args, **kwargs)
-            if response.status_code != 200:
-                raise Exception(f"HTTP error: {response.status_code}")
-            return response
-        except Exception as e:
-            print(f"Request failed: {e}, retrying in 30 seconds...")
-            time.sleep(30)
-    print("Request failed after retries.")
-    return None
-
-def print_header(LOCAL_CURR_TIME, LOCAL_CURR_TEMP):
-    """Display the current time and weather data."""
-    rtc_current = RTC()
-    timestamp = rtc_current.datetime()
-    dow_now = DOW[timestamp[3]] #calculate Day Of the Week for a date
-    timestring1 = f"{timestamp[2]:02d}-{timestamp[1]:02d}"
-    
-    if (int(timestamp[4]) + 1) == 24: #adjust for UTC
-        timestring2='00'
-    else:
-        timestring2=int(timestamp[4]) + 1
-    timestring2 = f"{timestring2:02d}"
-    
-    timestring = f"{dow_now} {timestring1} {timestring2}:{timestamp[5]:02d}"
-    print(f"{timestring} - Header Now")
-    print(f"{LOCAL_CURR_TIME} - Header Local Weather Data")
-
-    graphics.set_pen(BLACK)
-    graphics.rectangle(0, 0, 800, 60)
-    graphics.set_font("sans")
-    graphics.set_pen(WHITE)
-    graphics.set_thickness(4)
-    graphics.text(timestring, 15, 35, 800, 2)
-
-    graphics.set_pen(YELLOW)
-    graphics.text(f"{LOCAL_CURR_TEMP}c", 590, 35, 800, 2)
-    graphics.set_pen(BLACK)
-    return 1
-
-def my_bearer_token():
-    """Retrieve and return the bearer token."""
-    # Connect to WiFi
-    debug_print(f"Debug: Connect to wifi")
-    uasyncio.get_event_loop().run_until_complete(network_manager.client(WIFI_CONFIG.SSID, WIFI_CONFIG.PSK))
-
-    headers = {
-        'Content-type': 'application/json',
-        'Accept': 'application/json'
-    }
+async def sync_clock_if_due():
+    """Update RTC with time from NTP server, if it is due a resync."""
+    if not connection.ntp_due():
+        return
+    if not await connection.ensure():
+        return
+    print('Attempting NTP update...')
+    try:
+        connection.sync_clock()
+        print("NTP sync successful")
+    except OSError as error:
+        print(f"Error updating time from NTP: {error}")
+    print(f"UTC Time: {time.gmtime()}")
+
+
+def print_stats():
+    """Print the caches' and connections' stats for this cycle."""
+    print(f"Weather cache: {weather_cache_stats['hits']} hits, {weather_cache_stats['misses']} misses, "
+          f"{weather_cache_stats['evictions']} evictions, {weather_cache_stats['bytes']} bytes")
+    print(f"Panel refreshes: {render_stats['performed']} performed, {render_stats['skipped']} skipped")
+    display = hardware.display()
+    print(f"Display list: {display.stats['full']} full and {display.stats['partial']} partial redraws, "
+          f"{display.stats['commands']} commands, {display.stats['state_changes']} pen/font changes")
+    print(f"Screen interval: {poll_interval.seconds} seconds")
+    connection.report()
+    connection_pool.report()
+    save_last_known_good()
+    # Each deep sleep wake starts afresh, so the unfinished step can't wait for a later one
+    power_history.flush(current=SCHEDULER_MODE == "deep_sleep")
+    report_boot()
+    profiler.dump()
+    if PROFILE_FILE:
+        profiler.save(PROFILE_FILE)
+
+
+# Boot time
+# time.ticks_ms() counts from reset, so the time screens.render_screen()
+# notes when it sends the first frame to the panel is how long the board
+# took to get there from power-on or a deep sleep wake, imports included.
+boot_reported = [False]
+
+
+def report_boot():
+    """Print and profile the time from reset to the first frame, once, warning if over BOOT_BUDGET_MS."""
+    ms = screens.first_frame_at[0]
+    if boot_reported[0] or ms is None:
+        return
+    boot_reported[0] = True
+    if profiler.enabled:
+        profiler.record("boot to first frame", ms, 0, 0)
+    print(f"Boot to first frame: {ms} ms, budget {BOOT_BUDGET_MS} ms")
+    if ms > BOOT_BUDGET_MS:
+        print(f"Boot took {ms - BOOT_BUDGET_MS} ms over budget; freezing the modules into the firmware helps")
+
+
+class PollInterval:
+    """Time each screen stays up, adapted to daylight and how fast the readings change.
+
+    Overnight there is no PV to watch, so screens stay up for
+    MAX_UPDATE_INTERVAL. By day the interval halves whenever PV, load,
+    battery or grid moved by CHANGE_THRESHOLD watts since the last poll, and
+    grows by half while they hold steady. A load change of SHARP_CHANGE watts
+    drops straight to MIN_UPDATE_INTERVAL, day or night. The interval never
+    runs past the next sunrise or sunset, and starts again from
+    UPDATE_INTERVAL at sunrise."""
+
+    def __init__(self):
+        self.seconds = UPDATE_INTERVAL
+        self.daytime = None
+        self.last = None  # [fetched_at, pv, load, battery, grid] of the last snapshot seen
+
+    def update(self, snapshot, forecast, now):
+        """Work out the interval after a screen from the latest snapshot and local forecast."""
+        change = None
+        if snapshot.fetched_at is not None and (self.last is None or snapshot.fetched_at != self.last[0]):
+            readings = [snapshot.pv_power, snapshot.load_power, snapshot.battery_power, snapshot.grid_power]
+            if self.last is not None:
+                change = [abs(new - old) for new, old in zip(readings, self.last[1:])]
+            self.last = [snapshot.fetched_at] + readings
+
+        daylight = forecast.daylight(now) if forecast else None
+        # Without sun times for now, keep to what was last known
+        daytime = daylight[0] if daylight else self.daytime
+        if change and change[1] >= SHARP_CHANGE:
+            seconds = MIN_UPDATE_INTERVAL
+        elif daytime is False:
+            seconds = MAX_UPDATE_INTERVAL
+        elif self.daytime is False:
+            seconds = UPDATE_INTERVAL  # The sun has just come up
+        elif change is None:
+            seconds = self.seconds  # Nothing new to go on
+        elif max(change) >= CHANGE_THRESHOLD:
+            seconds = self.seconds // 2
+        else:
+            seconds = self.seconds * 3 // 2
+        seconds = max(MIN_UPDATE_INTERVAL, min(seconds, MAX_UPDATE_INTERVAL))
+        if daylight:
+            seconds = max(MIN_UPDATE_INTERVAL, min(seconds, daylight[1] - now))
+        self.daytime = daytime
+        self.seconds = seconds
+        return seconds
 
-    payload = {
-        "username": my_user_email,
-        "password": my_user_password,
-        "grant_type": "password",
-        "client_id": "csp-web"
-    }
+    def as_dict(self):
+        """The interval state as a JSON-serialisable dict, for keeping across deep sleep."""
+        return {'seconds': self.seconds, 'daytime': self.daytime, 'last': self.last}
 
-    debug_print(f"Debug: Get Bearer Token")
-    response = retry_request(requests.post, login_url, json=payload, headers=headers)
-    if response:
-        raw_data = response.json()
-        my_access_token = raw_data["data"]["access_token"]
-        global the_bearer_token_string
-        the_bearer_token_string = f'Bearer {my_access_token}'
-        debug_print(f"Bearer Token: {my_access_token}")
-        return my_access_token
-    return None
-
-def my_current_usage():
-    """Retrieve and display current solar usage and weather information."""
-    global LOCAL_CURR_TEMP
-    headers_and_token = {
-        'Content-type': 'application/json',
-        'Accept': 'application/json',
-        'Authorization': the_bearer_token_string
-    }
+    def restore(self, saved):
+        """Put back interval state saved by as_dict()."""
+        for name, value in saved.items():
+            setattr(self, name, value)
 
-    plant_response = retry_request(requests.get, plant_id_endpoint, headers=headers_and_token)
-    if plant_response:
-        plant_response = plant_response.json()
-        debug_print(f"Plant response: {plant_response}")
-
-    inverter_response = retry_request(requests.get, inverter_endpoint, headers=headers_and_token)
-    if inverter_response:
-        inverter_response = inverter_response.json()
-        debug_print(f"Inverter response: {inverter_response}")
-
-    grid_response = retry_request(requests.get, grid_endpoint, headers=headers_and_token)
-    if grid_response:
-        grid_response = grid_response.json()
-        debug_print(f"Grid response: {grid_response}")
-
-    load_response = retry_request(requests.get, load_endpoint, headers=headers_and_token)
-    if load_response:
-        load_response = load_response.json()
-        debug_print(f"Load response: {load_response}")
-
-    local_curr_temp_endpoint = f'https://api.open-meteo.com/v1/forecast?latitude={LOCAL_LOCATION[0]}&longitude={LOCAL_LOCATION[1]}&current=temperature_2m&hourly=temperature_2m,precipitation_probability&daily=temperature_2m_max,temperature_2m_min,precipitation_probability_max&wind_speed_unit=mph&precipitation_unit=inch&timezone=Europe%2FLondon&forecast_days=1'
-    curr_temp_response = retry_request(requests.get, local_curr_temp_endpoint)
-    if curr_temp_response:
-        curr_temp_response = curr_temp_response.json()
-        debug_print(f"Temperature response: {curr_temp_response}")
-
-    gc.collect()
-
-    if 'data' in plant_response and 'infos' in plant_response['data']:
-        for plant_info in plant_response['data']['infos']:
-            current_gen_w = int(plant_info['pac'])
-            debug_print(f"id:{plant_info['id']}:cur:{plant_info['pac']}W:update:{plant_info['updateAt']}")
-
-            # Ensure inverter_response['data'] exists and check for 'soc'
-            if inverter_response and 'data' in inverter_response and inverter_response['data'] is not None:
-                if 'soc' in inverter_response['data'] and inverter_response['data']['soc'] is not None:
-                    soc = round(float(inverter_response['data']['soc']))
-                else:
-                    print("SOC is missing or None, using default value of 0")
-                    soc = 0  # Assign default value
-            else:
-                print("Inverter data is missing, using default value for SOC.")
-                soc = 0
-
-            # Ensure 'power' exists before accessing it
-            if inverter_response and 'data' in inverter_response and inverter_response['data'] is not None:
-                if 'power' in inverter_response['data'] and inverter_response['data']['power'] is not None:
-                    bat_usage = int(inverter_response['data']['power'])
-                else:
-                    bat_usage = 0  # Default to 0 if 'power' is missing
-            else:
-                bat_usage = 0  # Default to 0 if 'data' is None or missing
 
-            # Ensure grid_response has valid data
-            if grid_response and 'data' in grid_response and 'vip' in grid_response['data'] and len(grid_response['data']['vip']) > 0:
-                grid_power = int(grid_response['data']['vip'][0]['power'])
-            else:
-                grid_power = 0  # Default to 0 if missing
+poll_interval = PollInterval()
 
-            if load_response and 'data' in load_response and 'vip' in load_response['data'] and len(load_response['data']['vip']) > 0:
-                load_power = int(load_response['data']['vip'][0]['power'])
-            else:
-                load_power = 0  # Default to 0 if missing
 
-            if 'current' in curr_temp_response and 'temperature_2m' in curr_temp_response['current']:
-                LOCAL_CURR_TEMP = curr_temp_response['current']['temperature_2m']
-            else:
-                LOCAL_CURR_TEMP = 0  # Default temperature if missing
+def next_interval():
+    """Seconds until the next screen, adapted to the latest readings."""
+    return poll_interval.update(inverter, cached_forecast(config.local_location()), unix_time())
 
-            if 'current' in curr_temp_response and 'time' in curr_temp_response['current']:
-                LOCAL_CURR_TIME = curr_temp_response['current']['time']
-            else:
-                LOCAL_CURR_TIME = "unknown"  # Default time if missing
-
-            print_header(LOCAL_CURR_TIME, LOCAL_CURR_TEMP)
-            display_power_data(current_gen_w, load_power, bat_usage, grid_power)
-            draw_batt(soc)
-            current_gen_w = []
-            #load_power = []
-            #bat_usage = []
-            #grid_power = []
-            
-            graphics.update()
-
-    return current_gen_w
-
-
-def display_power_data(current_gen_w, load_power, bat_usage, grid_power):
-    """Display power generation, load, battery, and grid information."""
-    pv_titles_y = 153
-    pv_titles = ['Pv:', 'Ld:', 'Bt:', 'Gr:']
-    for i, title in enumerate(pv_titles):
-        graphics.text(title, 0, pv_titles_y + i * 100, 800, 2)
-
-    graphics.set_font("sans")
-    graphics.set_thickness(8)
-
-    # Generated electricity
-    graphics.set_pen(RED if current_gen_w < 100 else GREEN)
-    graphics.text(f"{current_gen_w}W", 110, 132, 800, 4)
-
-    # Load
-    graphics.set_pen(BLACK)
-    graphics.text(f"{load_power}W", 110, 232, 800, 4)
-
-    # Battery usage
-    graphics.set_pen(RED if bat_usage > 0 else GREEN)
-    graphics.text(f"{abs(bat_usage)}W{'+' if bat_usage > 0 else '-'}", 110, 336, 800, 4)
-
-    # Grid
-    graphics.set_pen(BLUE if grid_power > 0 else RED)
-    graphics.text(f"{abs(grid_power)}W{'-' if grid_power < 0 else ''}", 110, 440, 800, 4)
-    
-
-def my_current_weather(LOCATION):
-    """Fetch and display the current weather for a given location."""
-    headers = {
-        'Content-type': 'application/json',
-        'Accept': 'application/json'
-    }
-    curr_temp_endpoint = f'https://api.open-meteo.com/v1/forecast?latitude={LOCATION[0]}&longitude={LOCATION[1]}&current=temperature_2m&hourly=temperature_2m,precipitation_probability&daily=temperature_2m_max,temperature_2m_min,precipitation_probability_max&wind_speed_unit=mph&precipitation_unit=inch&timezone=Europe%2FLondon&forecast_days=5'
 
-    curr_temp_req = retry_request(requests.get, curr_temp_endpoint)
-    if curr_temp_req:
-        curr_temp_response = curr_temp_req.json()
-        debug_print(f"Weather response for {LOCATION[2]}: {curr_temp_response}")
-    else:
-        print(f"Error: Failed to fetch weather for {LOCATION[2]}")
-        return
+# Prefetching
+# While a screen is displayed, the last PREFETCH_LEAD seconds of its dwell
+# time are spent fetching the next screen's data into the inverter snapshot
+# and weather cache, asking for anything that would expire before the next
+# screen is drawn. The next screen then finds its data fresh in the caches
+# and only has to render. A prefetch that hasn't finished when the screen is
+# due is cancelled, and the screen is drawn from the caches all the same; if
+# that leaves it stale, revalidate() fetches its data in the background and
+# draws it again.
 
-    # Extract relevant weather information
-    LOCAL_CURR_TEMP = curr_temp_response['current']['temperature_2m']
-    LOCAL_CURR_TIME = curr_temp_response['current']['time']
-    
-    # Display weather data using print_header
-    print_header(LOCAL_CURR_TIME, LOCAL_CURR_TEMP)
-    
-    forecast_title_y = 50
-    forecast_offset = 60
-    hci = 0
-
-    # Extract the RTC's current time
-    rtc_current = RTC()
-    timestamp = rtc_current.datetime()
-    first_hour = int(timestamp[4]) + 1
-    last_hour = first_hour + 3
-
-    # Display the hourly weather forecast for the next few hours
-    for i in range(first_hour, last_hour):
-        hci += 1
-        hrfc_day, hrfc_hour = curr_temp_response['hourly']['time'][i].split('T')
-        graphics.set_font("serif")        
-        graphics.set_pen(GREEN)
-        graphics.set_thickness(6)
-        graphics.text(hrfc_hour, 0, forecast_title_y + (forecast_offset * hci), 800, 2)
-        hourly_forecast = f"{curr_temp_response['hourly']['temperature_2m'][i]}c {curr_temp_response['hourly']['precipitation_probability'][i]}%"
-        graphics.set_pen(BLACK)
-        graphics.set_font("sans")
-        graphics.set_thickness(4)
-        graphics.text(hourly_forecast, 190, forecast_title_y + (forecast_offset * hci), 800, 2)
-
-    # Display the location name and additional weather information
-    graphics.set_font("sans")        
-    graphics.set_pen(RED)
-    graphics.set_thickness(10)
-    graphics.text(LOCATION[2], 530, 130, 800, 4, 0, 1)
-    
-    graphics.set_font("sans")
-    graphics.set_pen(BLACK)
-    graphics.set_thickness(4)
-    soc = get_soc()
-    
-    graphics.text("Battery", 545, 190, 800, 1)
-    soc_string = f"{soc}%"
-    graphics.text(soc_string, 545, 240, 800, 2)
-    
-    graphics.line(0, 280, 190, 280, 4) # line(x1, y1, x2, y2, thickness)
-    
-    # Display forecast labels
-    graphics.set_font("sans")
-    graphics.set_pen(BLACK)
-    graphics.set_thickness(4)
-    graphics.text("Low       High     Rain", 230, 280, 800, 1)
-    
-    # Extract daily weather forecast data
-    forecast_start_y = 330
-    forecast_offset_y = 60
-    
-    for i in range(0, 3):
-        forecast_dt = curr_temp_response['daily']['time'][i]
-        forecast_year, forecast_month, forecast_day = map(int, forecast_dt.split('-'))
-        day_of_week = calc_dow(forecast_year, forecast_month, forecast_day)
-        
-        graphics.set_font("serif")
-        graphics.set_pen(BLACK)
-        graphics.set_thickness(6)
-        #debug_print("DEBUG: DOW num / day:" + str(day_of_week) + " - " + str(fDOW[day_of_week]))
-        graphics.text(fDOW[day_of_week], 0, forecast_start_y + (forecast_offset_y * i), 800, 2)
-        
-        daily_forecast = f"{curr_temp_response['daily']['temperature_2m_min'][i]}c {curr_temp_response['daily']['temperature_2m_max'][i]}c {curr_temp_response['daily']['precipitation_probability_max'][i]}%"
-        graphics.set_pen(BLUE)
-        graphics.set_thickness(4)
-        graphics.text(daily_forecast, 140, forecast_start_y + (forecast_offset_y * i), 800, 2, 0, 1)
-        
-    #Get the battery state of charge (SOC)    
-    soc = get_soc()
-    debug_print(f"DEBUG SOC = {soc}")
-        
-    graphics.update()
-    return 1
-
-def remote_weather(REMOTE_LOCATIONS):
-    """Fetch and display the weather for multiple locations."""
-    headers = {
-        'Content-type': 'application/json',
-        'Accept': 'application/json'
-    }
+async def prefetch_usage(margin):
+    await bearer_token()
+    await uasyncio.gather(inverter.refresh(margin=margin), weather_for([config.local_location()], margin=margin))
 
-    weather_data = {}
 
-    for location in REMOTE_LOCATIONS:
-        location_info = locations.get(location)
-        if not location_info:
-            print(f"Location {location} not found in the locations dictionary.")
-            continue
+async def prefetch_weather(margin):
+    await uasyncio.gather(inverter.refresh(margin=margin), weather_for([config.local_location()], margin=margin))
 
-        latitude, longitude, short_name = location_info
-        curr_temp_endpoint = f'https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current=temperature_2m&hourly=temperature_2m,precipitation_probability&daily=temperature_2m_max,temperature_2m_min,precipitation_probability_max&wind_speed_unit=mph&precipitation_unit=inch&timezone=Europe%2FLondon&forecast_days=1'
 
-        response = retry_request(requests.get, curr_temp_endpoint)
-        if response:
-            weather_data[location] = response.json()
-            debug_print(f"Weather response for {short_name}: {weather_data[location]}")
-        else:
-            print(f"Error: Failed to fetch weather for {short_name} (status code: {response.status_code})")
-            continue
-
-    # Display weather data for all remote locations
-    graphics.set_font("serif")
-    graphics.set_pen(BLACK)
-    graphics.set_thickness(6)
-    
-    y_position = 453  # Starting Y position for displaying weather
-    for i, location in enumerate(REMOTE_LOCATIONS):
-        if location in weather_data:
-            location_info = locations[location]
-            short_name = location_info[2]
-            min_temp = weather_data[location]['daily']['temperature_2m_min'][0]
-            max_temp = weather_data[location]['daily']['temperature_2m_max'][0]
-            forecast_text = f"{short_name}: {min_temp}c {max_temp}c"
-            #debug_print("DEBUG: Y POS = " + str(y_position))
-            graphics.text(forecast_text, 0, y_position, 800, 2)
-            y_position -= 75  # Move up for the next location
-        else:
-            debug_print("Skipping " + location + ", do not have weather data")
-
-    soc = get_soc()
-    draw_batt(soc)
-    # Display weather data using print_header with cached data
-    print_header(LOCAL_CURR_TIME, LOCAL_CURR_TEMP)
-    
-    graphics.update()
-    return 1
-
-
-def get_soc():
-    """Get the state of charge for the battery."""
-    headers_and_token = {
-        'Content-type': 'application/json',
-        'Accept': 'application/json',
-        'Authorization': the_bearer_token_string
-    }
-    inverter_response = retry_request(requests.get, inverter_endpoint, headers=headers_and_token)
-    if inverter_response:
-        inverter_response = inverter_response.json()
-        debug_print(f"Inverter response: {inverter_response}")
-    else:
-        return 0
-        
-    # Ensure inverter_response['data'] exists and check for 'soc'
-    soc = 0 #default to a 0 State of Charge for the battery
-    if inverter_response and 'data' in inverter_response and inverter_response['data'] is not None:
-        if 'soc' in inverter_response['data'] and inverter_response['data']['soc'] is not None:
-            soc = round(float(inverter_response['data']['soc']))
-        else:
-            print("SOC is missing or None, using default value of 0")
-            soc = 0  # Assign default value
-    else:
-        print("Inverter data is missing, using default value for SOC.")
-        soc = 0
-        
-    return soc
-
-
-def draw_batt(soc):
-    """Draw battery status indicator based on state of charge."""
-    graphics.set_font("sans")
-    graphics.set_pen(BLACK)
-    graphics.set_thickness(4)
-    graphics.text('Batt', 730, 105, 800, 1)
-
-    batt_y = 130
-    batt_c = [GREEN if soc >= 80 else BLACK] * 6
-
-    empty_sqrs = max(0, 6 - round(soc / 16.6))
-
-    for i in range(6):
-        graphics.set_pen(batt_c[i])
-        graphics.rectangle(720, batt_y, 80, 50)  # draw rectangle - x,y,width, height
-        if i < empty_sqrs:
-            graphics.set_pen(WHITE)
-            graphics.rectangle(730, batt_y, 60, 40)
-        batt_y += 60
-
-    # Display percentage and battery level indicator
-    graphics.set_pen(BLACK)
-    CURR_TRI_Y = 490 - round(soc * 3.5) + 10
-    graphics.triangle(690, CURR_TRI_Y - 40, 690, CURR_TRI_Y, 718, CURR_TRI_Y - 20)
-
-    text_y = CURR_TRI_Y - 60 if soc < 45 else CURR_TRI_Y + 30
-    graphics.text(f"{soc}%" if soc < 100 else "Full", 585, text_y, 800, 2)
-
-
-def calc_dow(year,month,day):
-    """Calculate the day of the week for a given date.
-    Sunday = 1, Saturday = 7
-    http://en.wikipedia.org/wiki/Zeller%27s_congruence """
-    m, q = month, day
-    if m == 1:
-        m = 13
-        year -= 1
-    elif m == 2:
-        m = 14
-        year -= 1
-    K = year % 100    
-    J = year // 100
-    f = (q + int(13*(m + 1)/5.0) + K + int(K/4.0))
-    fg = f + int(J/4.0) - 2 * J
-    fj = f + 5 - J
-    if year > 1582:
-        dow = fg % 7
-    else:
-        dow = fj % 7
-    if dow == 0:
-        dow = 7
-    return dow
+async def prefetch_remote(margin):
+    await uasyncio.gather(inverter.refresh(margin=margin), weather_for(remote_locations(), WEATHER_DAILY, margin))
 
-def clear_screen():
-    """Clear the screen."""
-    graphics.set_pen(WHITE)
-    graphics.clear()
 
+async def dwell(seconds, prefetch):
+    """Wait out a screen's display time, prefetching the next screen's data towards the end."""
+    lead = min(PREFETCH_LEAD, seconds)
+    await uasyncio.sleep(seconds - lead)
+    start = time.ticks_ms()
+    try:
+        with span("prefetch"):
+            await uasyncio.wait_for(prefetch(lead), lead)
+    except uasyncio.TimeoutError:
+        print("Prefetch didn't finish in time and was cancelled")
+    except Exception as e:
+        print(f"Prefetch failed: {e}")
+    remaining = lead - time.ticks_diff(time.ticks_ms(), start) / 1000
+    if remaining > 0:
+        await uasyncio.sleep(remaining)
+
+
+# Main loop
+# update() runs three kinds of task on one uasyncio event loop: the screen
+# rotation, a task polling buttons A to C, and fetches. Screens are always
+# drawn from the caches; a screen drawn from stale data is redrawn once a
+# background fetch brings fresh data, and each screen's dwell prefetches the
+# next one's data (see dwell()). A button press cancels the dwell and the
+# pressed screen is drawn at once, as fast as the panel allows.
+BUTTON_POLL_MS = 50  # how often the buttons are read
+
+
+def remote_locations():
+    locations = config.locations()
+    return [locations[location] for location in locations['ListOrder'] if location in locations]
+
+
+# (name, draw from the caches (force), fetch its data (margin), its forecast locations) for each screen
+LOOP_SCREENS = [
+    ("usage", lambda force: my_current_usage(fetch=False, force=force), prefetch_usage,
+     lambda: [config.local_location()]),
+    ("weather", lambda force: my_current_weather(config.local_location(), fetch=False, force=force),
+     prefetch_weather, lambda: [config.local_location()]),
+    ("remote", lambda force: remote_weather(config.locations()['ListOrder'], fetch=False, force=force),
+     prefetch_remote, remote_locations),
+]
+requested_screen = [None]  # index of the screen whose button was pressed, until it is shown
+dwelling = [None]  # the rotation's running dwell() task, cancelled by a button press
+
+
+def screen_buttons():
+    """Buttons A to C, for the screens in LOOP_SCREENS."""
+    frame = hardware.inky().inky_frame
+    return [frame.button_a, frame.button_b, frame.button_c]
+
+
+async def watch_buttons():
+    """Poll buttons A to C, asking for their screen as soon as one is pressed."""
+    buttons = screen_buttons()
+    held = None
+    while True:
+        pressed = None
+        for index, button in enumerate(buttons):
+            if button.read():
+                pressed = index
+        if pressed is not None and pressed != held:
+            print(f"Button pressed for the {LOOP_SCREENS[pressed][0]} screen")
+            requested_screen[0] = pressed
+            if dwelling[0]:
+                dwelling[0].cancel()
+        held = pressed
+        await uasyncio.sleep_ms(BUTTON_POLL_MS)
+
+
+async def housekeeping():
+    """Resync the clock if due, renew the bearer token and backfill the power history if needed."""
+    with span("ntp"):
+        await sync_clock_if_due()
+    await bearer_token()
+    # The history is only a nicety, so a failed backfill mustn't stop the screens
+    try:
+        with span("backfill"):
+            await backfill_history()
+    except Exception as e:
+        print(f"Backfilling the power history failed: {e}")
 
-def update_clock_ntp():
-    """Update RTC with time from NTP server."""
-    uasyncio.get_event_loop().run_until_complete(network_manager.client(WIFI_CONFIG.SSID, WIFI_CONFIG.PSK))
-    rtc = RTC()
-    print('Attempting NTP update...')
+
+def show_screen(index, force=False):
+    """Draw a screen from the caches and light its button; force=True refreshes the panel even if unchanged."""
+    name, draw, _, _ = LOOP_SCREENS[index]
+    hardware.inky().clear_button_leds()
+    screen_buttons()[index].led_on()
+    with span(f"{name} screen" if profiler.enabled else None):
+        draw(force)
+
+
+def screen_stale(index):
+    """Return True if a screen was drawn from data past its cache lifetime."""
+    return not inverter.fresh() or not all(forecast_fresh(info) for info in LOOP_SCREENS[index][3]())
+
+
+async def revalidate(index):
+    """Fetch the data for a screen drawn stale, then draw it again."""
     try:
-        ntptime.settime()
-        print("NTP sync successful")
-    except OSError as error:
-        print(f"Error updating time from NTP: {error}")
-    timestamp = rtc.datetime()
-    print(f"UTC Time: {timestamp}")
+        with span("revalidate"):
+            await LOOP_SCREENS[index][2](0)
+    except Exception as e:
+        print(f"Refreshing the {LOOP_SCREENS[index][0]} screen failed: {e}")
+        return
+    show_screen(index)
+
+
+async def run_screens():
+    """Rotate through the screens, jumping to one when its button is pressed."""
+    buttons = uasyncio.create_task(watch_buttons())
+    revalidating = None
+    index = 0
+    pressed = False  # whether the screen at index was asked for by a button
+    try:
+        while True:
+            # A button press is answered first; housekeeping waits for the rotation to come round
+            if index == 0 and not pressed:
+                await housekeeping()
+            if revalidating:
+                revalidating.cancel()
+                revalidating = None
+            show_screen(index, force=pressed)
+            if screen_stale(index):
+                revalidating = uasyncio.create_task(revalidate(index))
+            if index == len(LOOP_SCREENS) - 1:
+                print_stats()
+            gc.collect()
+
+            following = (index + 1) % len(LOOP_SCREENS)
+            if requested_screen[0] is None:
+                dwelling[0] = uasyncio.create_task(dwell(next_interval(), LOOP_SCREENS[following][2]))
+                try:
+                    await dwelling[0]
+                except uasyncio.CancelledError:
+                    pass
+                dwelling[0] = None
+            pressed = requested_screen[0] is not None
+            if pressed:
+                index, requested_screen[0] = requested_screen[0], None
+            else:
+                index = following
+    finally:
+        buttons.cancel()
+        if revalidating:
+            revalidating.cancel()
 
 
 def update():
     """Main update loop."""
-    while True:
-        clear_screen()
-        ih.clear_button_leds()
-        ih.inky_frame.button_a.led_on()
-        update_clock_ntp()
-        my_bearer_token()
-        ih.inky_frame.button_a.led_off()
-        ih.inky_frame.button_b.led_on()
-        my_current_usage()
-        ih.inky_frame.button_b.led_off()
-        ih.inky_frame.button_c.led_on()
-
-        debug_print(f"Debug: gc.mem_alloc {gc.mem_alloc()}")
-        debug_print(f"Debug: gc.mem_free {gc.mem_free()}")
-        gc.collect()
-        debug_print("Debug: gc.collect()")
-        debug_print(f"Debug: gc.mem_alloc {gc.mem_alloc()}")
-        debug_print(f"Debug: gc.mem_free {gc.mem_free()}")
-        time.sleep(UPDATE_INTERVAL)
-
-        clear_screen()
-        #update_clock_ntp()
-        my_current_weather(locations['Local'])
-        ih.inky_frame.button_c.led_off()
-        ih.inky_frame.button_d.led_on()
-        debug_print(f"Debug: gc.mem_alloc {gc.mem_alloc()}")
-        debug_print(f"Debug: gc.mem_free {gc.mem_free()}")
-        gc.collect()
-        debug_print("Debug: gc.collect()")
-        debug_print(f"Debug: gc.mem_alloc {gc.mem_alloc()}")
-        debug_print(f"Debug: gc.mem_free {gc.mem_free()}")
-        time.sleep(UPDATE_INTERVAL)
-
-        clear_screen()
-        #update_clock_ntp()
-        remote_weather(locations['ListOrder'])
-        ih.inky_frame.button_d.led_off()
-        ih.inky_frame.button_e.led_on()
-
-        debug_print(f"Debug: gc.mem_alloc {gc.mem_alloc()}")
-        debug_print(f"Debug: gc.mem_free {gc.mem_free()}")
-        gc.collect()
-        debug_print("Debug: gc.collect()")
-        debug_print(f"Debug: gc.mem_alloc {gc.mem_alloc()}")
-        debug_print(f"Debug: gc.mem_free {gc.mem_free()}")
-        time.sleep(UPDATE_INTERVAL)
+    # The Pico's own RTC restarts from scratch after a power cut, and the
+    # first frame's clock and data ages need the time before NTP has run
+    hardware.pcf_to_pico_rtc()
+    # Put the last known good data up straight away; the first cycle then refreshes it
+    with span("first frame"):
+        power_history.load()
+        if restore_last_known_good():
+            my_current_usage(fetch=False)
+    run_async(run_screens())
+
+
+def usage_screen():
+    """Sync the clock, log in if needed and show the usage screen."""
+    update_clock_ntp()
+    my_bearer_token()
+    run_async(backfill_history())
+    my_current_usage()
+    print_stats()
+
+
+def local_weather_screen():
+    """Show the local weather screen."""
+    my_current_weather(config.local_location())
+    print_stats()
+
+
+def remote_weather_screen():
+    """Show the remote weather screen."""
+    remote_weather(config.locations()['ListOrder'])
+    print_stats()
+
+
+SCREENS = [
+    ("usage", usage_screen),
+    ("weather", local_weather_screen),
+    ("remote", remote_weather_screen),
+]
+
+
+def deep_sleep_update(backend=None):
+    """Show the next screen, then power off until the RTC alarm wakes us for the one after.
+
+    backend defaults to the board's RTC and vsys hold pin; the sim passes a
+    FakeBackend."""
+    # The Pico's own RTC restarts from scratch after a power cut
+    hardware.pcf_to_pico_rtc()
+    # Fills in anything the state file lacks
+    restore_last_known_good()
+    power_history.load()
+    if backend is None:
+        backend = HardwareBackend(hardware.rtc(), hardware.hold_power())
+    scheduler = SleepScheduler(SCREENS, backend, STATE_FILE, next_interval, save_cached_data, restore_cached_data)
+    scheduler.run()
+
+
+def main():
+    """Keep the board powered, then run the screens the way SCHEDULER_MODE says."""
+    hardware.hold_power()
+    if SCHEDULER_MODE == "deep_sleep":
+        deep_sleep_update()
+    else:
+        update()
 
 
 # Run the update loop if executed as a script
 if __name__ == "__main__":
-    update()
-
-
+    main()
@@ -0,0 +1,454 @@
+"""The Sunsynk API: logging in, the inverters' readings and their power history."""
+
+import uasyncio
+import json
+import time
+import struct
+
+import config
+from config import (TOKEN_FILE, TOKEN_REFRESH_MARGIN, DATA_SOURCE, INVERTER_SNAPSHOT_TTL, PLANTS_PAGE_SIZE,
+                    HISTORY_FILE, HISTORY_STEP, HISTORY_BLOCK, HISTORY_BACKFILL_GAP, EPOCH_OFFSET, debug_print)
+from net import async_retry_request, fetch_json, fetch_all, gather_limited, run_async
+from weather import unix_time, local_utc_offset
+from power_history import PowerHistory
+from profiler import span
+
+# Cached bearer token, see my_bearer_token()
+token_cache = {}
+the_bearer_token_string = ""
+
+# API Endpoints
+login_url = 'https://api.sunsynk.net/oauth/token'
+plant_id_endpoint = 'https://api.sunsynk.net/api/v1/plants?page={}&limit={}&name=&status='  # formatted with the page and its size
+# The realtime endpoints are formatted with an inverter serial
+inverter_endpoint = 'https://api.sunsynk.net/api/v1/inverter/battery/{0}/realtime?sn={0}&lan=en'
+grid_endpoint = 'https://api.sunsynk.net/api/v1/inverter/grid/{0}/realtime?sn={0}'
+load_endpoint = 'https://api.sunsynk.net/api/v1/inverter/load/{0}/realtime?sn={0}'
+flow_endpoint = 'https://api.sunsynk.net/api/v1/plant/energy/{}/flow'  # formatted with the plant id
+history_endpoint = 'https://api.sunsynk.net/api/v1/plant/energy/{0}/day?lan=en&date={1}&id={0}'  # plant id, YYYY-MM-DD
+
+# Fields kept from each endpoint's response
+PLANT_FIELDS = ['data.total', 'data.infos[*].id', 'data.infos[*].pac', 'data.infos[*].updateAt']
+BATTERY_FIELDS = ['data.soc', 'data.power']
+VIP_FIELDS = ['data.vip[0].power']
+FLOW_FIELDS = ['data.pvPower', 'data.loadOrEpsPower', 'data.battPower', 'data.gridOrMeterPower',
+               'data.soc', 'data.toBat', 'data.toGrid']
+# The day chart has a point every 5 minutes for each series; only one per HISTORY_STEP is kept
+HISTORY_FIELDS = ['data.infos[*].label', f'data.infos[*].records[::{HISTORY_STEP // 300}].time',
+                  f'data.infos[*].records[::{HISTORY_STEP // 300}].value']
+HISTORY_SERIES = {'PV': 0, 'Load': 1, 'Battery': 2, 'Grid': 3}  # day chart label -> power_history series
+
+
+def load_token():
+    """Load the bearer token saved to flash by a previous run."""
+    global token_cache, the_bearer_token_string
+    try:
+        f = open(TOKEN_FILE, "r")
+    except OSError:
+        return  # None saved yet
+    try:
+        with f:
+            token_cache = json.load(f)
+        the_bearer_token_string = f"Bearer {token_cache['access_token']}"
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring saved token: {e}")
+        token_cache = {}
+
+
+def save_token():
+    """Persist the bearer token so a reboot doesn't force a new login."""
+    try:
+        with open(TOKEN_FILE, "w") as f:
+            json.dump(token_cache, f)
+    except OSError as e:
+        print(f"Unable to save token: {e}")
+
+
+def token_valid():
+    """Return True if the cached token is usable for a while yet."""
+    if 'access_token' not in token_cache:
+        return False
+    return time.time() < token_cache.get('expires_at', 0) - TOKEN_REFRESH_MARGIN
+
+
+async def request_token(payload):
+    """POST a grant to the login endpoint and cache the token it returns."""
+    global token_cache, the_bearer_token_string
+    headers = {
+        'Content-type': 'application/json',
+        'Accept': 'application/json'
+    }
+
+    with span("token"):
+        response = await async_retry_request("POST", login_url, headers, payload)
+    if not response:
+        return None
+    raw_data = response.json()
+    data = raw_data.get("data") if raw_data else None
+    if not data or "access_token" not in data:
+        print(f"Login rejected: {raw_data.get('msg') if raw_data else 'no response'}")
+        return None
+
+    token_cache = {
+        'access_token': data["access_token"],
+        'refresh_token': data.get("refresh_token"),
+        'expires_at': time.time() + int(data.get("expires_in", 0))
+    }
+    the_bearer_token_string = f'Bearer {token_cache["access_token"]}'
+    save_token()
+    debug_print(f"Bearer Token: {token_cache['access_token']}, expires in {data.get('expires_in')}s")
+    return token_cache['access_token']
+
+
+async def bearer_token(force=False):
+    """Return the bearer token, logging in only when needed.
+
+    The cached token is reused until shortly before it expires, then renewed
+    with the refresh grant. A full password login is only done when there is
+    no refresh token or the refresh is rejected. force=True skips the cache,
+    e.g. after the API has answered 401."""
+    if not token_cache:
+        load_token()
+    if not force and token_valid():
+        debug_print("Debug: Reusing cached Bearer Token")
+        return token_cache['access_token']
+
+    if token_cache.get('refresh_token'):
+        debug_print(f"Debug: Refresh Bearer Token")
+        access_token = await request_token({
+            "grant_type": "refresh_token",
+            "refresh_token": token_cache['refresh_token'],
+            "client_id": "csp-web"
+        })
+        if access_token:
+            return access_token
+
+    debug_print(f"Debug: Get Bearer Token")
+    email, password, _ = config.credentials()
+    return await request_token({
+        "username": email,
+        "password": password,
+        "grant_type": "password",
+        "client_id": "csp-web"
+    })
+
+
+def my_bearer_token(force=False):
+    """Retrieve and return the bearer token."""
+    return run_async(bearer_token(force))
+
+
+def auth_headers():
+    """Headers for an authenticated Sunsynk API request."""
+    return {
+        'Content-type': 'application/json',
+        'Accept': 'application/json',
+        'Authorization': the_bearer_token_string
+    }
+
+
+class InverterSnapshot:
+    """Latest realtime inverter readings, shared by every screen.
+
+    With DATA_SOURCE = "flow" one request per plant to the energy-flow
+    endpoint fills in every reading, the plant ids having been looked up once
+    from the plants list. If that fails, or with DATA_SOURCE = "realtime", the
+    plants list and each inverter's battery, grid and load endpoints are
+    fetched together. Either way there is a row of readings per plant (or per
+    inverter, for the realtime endpoints) and the totals across them.
+    Readings are reused until INVERTER_SNAPSHOT_TTL has passed. Callers that
+    ask while a fetch is running wait for it rather than starting their own.
+    A reading missing from a response keeps its previous value."""
+
+    def __init__(self):
+        self.soc = 0
+        self.battery_power = 0
+        self.grid_power = 0
+        self.load_power = 0
+        self.pv_power = 0
+        self.plants = []  # (plant id, PV watts) for each plant on the account
+        self.plant_ids = []
+        self.rows = []  # (label, pv, load, battery, grid, soc) per plant or inverter; None where unknown
+        self.fetched_at = None
+        self.inflight = None  # uasyncio.Event set when the running fetch finishes
+
+    def fresh(self, margin=0):
+        """Return True if the readings will still be within INVERTER_SNAPSHOT_TTL in `margin` seconds."""
+        return self.fetched_at is not None and time.time() + margin - self.fetched_at < INVERTER_SNAPSHOT_TTL
+
+    def as_dict(self):
+        """The readings as a JSON-serialisable dict, for keeping across deep sleep."""
+        return {
+            'soc': self.soc,
+            'battery_power': self.battery_power,
+            'grid_power': self.grid_power,
+            'load_power': self.load_power,
+            'pv_power': self.pv_power,
+            'plants': self.plants,
+            'plant_ids': self.plant_ids,
+            'rows': self.rows,
+            'fetched_at': self.fetched_at
+        }
+
+    def restore(self, saved):
+        """Put back readings saved by as_dict()."""
+        for name, value in saved.items():
+            setattr(self, name, value)
+        self.plants = [tuple(plant) for plant in self.plants]
+        self.rows = [tuple(row) for row in self.rows]
+
+    # to_bytes() layout: the totals, then each plant, then each row as a
+    # length-prefixed label and its readings. Unknown readings are stored as
+    # NO_READING, or NO_SOC for the state of charge.
+    TOTALS = "<iiiiBBB"  # pv, load, battery, grid, soc, plant count, row count
+    PLANT = "<ii"  # plant id, pv
+    ROW = "<iiiiB"  # pv, load, battery, grid, soc
+    NO_READING = -0x80000000
+    NO_SOC = 255
+
+    def to_bytes(self):
+        """The readings packed for the last known good store; restore_bytes() puts them back."""
+        parts = [struct.pack(self.TOTALS, self.pv_power, self.load_power, self.battery_power, self.grid_power,
+                             self.soc, len(self.plants), len(self.rows))]
+        for plant_id, pv in self.plants:
+            parts.append(struct.pack(self.PLANT, int(plant_id), pv))
+        for row in self.rows:
+            label = row[0].encode()
+            readings = [self.NO_READING if value is None else value for value in row[1:5]]
+            soc = self.NO_SOC if row[5] is None else row[5]
+            parts.append(bytes([len(label)]) + label + struct.pack(self.ROW, *readings, soc))
+        return b"".join(parts)
+
+    def restore_bytes(self, data, fetched_at):
+        """Put back readings packed by to_bytes() and fetched at `fetched_at`."""
+        pv, load, battery, grid, soc, plant_count, row_count = struct.unpack_from(self.TOTALS, data, 0)
+        pos = struct.calcsize(self.TOTALS)
+        plants = []
+        for _ in range(plant_count):
+            plants.append(struct.unpack_from(self.PLANT, data, pos))
+            pos += struct.calcsize(self.PLANT)
+        rows = []
+        for _ in range(row_count):
+            label = data[pos + 1:pos + 1 + data[pos]].decode()
+            pos += 1 + data[pos]
+            values = struct.unpack_from(self.ROW, data, pos)
+            pos += struct.calcsize(self.ROW)
+            readings = tuple(None if value == self.NO_READING else value for value in values[:4])
+            rows.append((label,) + readings + (None if values[4] == self.NO_SOC else values[4],))
+
+        self.pv_power, self.load_power, self.battery_power, self.grid_power, self.soc = pv, load, battery, grid, soc
+        self.plants = plants
+        self.plant_ids = [plant_id for plant_id, _ in plants]
+        self.rows = rows
+        self.fetched_at = fetched_at
+
+    async def refresh(self, force=False, margin=0):
+        """Make sure the snapshot is fresh (for `margin` seconds more), fetching it if needed."""
+        if self.inflight:
+            await self.inflight.wait()
+            return self
+        if self.fresh(margin) and not force:
+            return self
+        self.inflight = uasyncio.Event()
+        fetched_at = self.fetched_at
+        try:
+            if not (DATA_SOURCE == "flow" and await self.fetch_flow()):
+                await self.fetch_realtime()
+        finally:
+            self.inflight.set()
+            self.inflight = None
+        if self.fetched_at != fetched_at:
+            power_history.record(unix_time(), (self.pv_power, self.load_power, self.battery_power, self.grid_power))
+        return self
+
+    async def fetch_plants(self, headers_and_token, allow_stale=True):
+        """Read every plant on the account, a page at a time; returns False if it failed.
+
+        The previous list is kept unless every page was read. allow_stale is
+        passed on to fetch_json()."""
+        plants = []
+        page = 1
+        while True:
+            plant_response = await fetch_json("GET", plant_id_endpoint.format(page, PLANTS_PAGE_SIZE),
+                                              headers_and_token, allow_stale, PLANT_FIELDS)
+            debug_print(f"Plant response: {plant_response}")
+            data = plant_response.get('data') if plant_response else None
+            if not data or 'infos' not in data:
+                return False
+            for plant_info in data['infos']:
+                debug_print(f"id:{plant_info['id']}:cur:{plant_info['pac']}W:update:{plant_info['updateAt']}")
+                plants.append((plant_info['id'], int(plant_info['pac'])))
+            if not data['infos'] or len(plants) >= int(data.get('total') or 0):
+                break
+            page += 1
+
+        self.plants = plants
+        self.plant_ids = [plant_id for plant_id, _ in plants]
+        self.pv_power = sum(pac for _, pac in plants)
+        return True
+
+    def combine(self, rows):
+        """Keep the per-plant rows, filling gaps from the previous rows, and total them up."""
+        previous = {row[0]: row for row in self.rows}
+        merged = []
+        for row in rows:
+            old = previous.get(row[0])
+            if old:
+                row = tuple(old[i] if value is None else value for i, value in enumerate(row))
+            merged.append(row)
+        self.rows = merged
+
+        for index, name in ((2, 'load_power'), (3, 'battery_power'), (4, 'grid_power')):
+            values = [row[index] for row in merged if row[index] is not None]
+            if values:
+                setattr(self, name, sum(values))
+        socs = [row[5] for row in merged if row[5] is not None]
+        if socs:
+            self.soc = round(sum(socs) / len(socs))
+        else:
+            print("SOC is missing or None, keeping the previous value")
+
+    async def fetch_flow(self):
+        """Fill the snapshot from each plant's energy-flow endpoint; returns False if any failed."""
+        headers_and_token = auth_headers()
+        if not self.plant_ids and not await self.fetch_plants(headers_and_token):
+            return False
+
+        flow_responses = await gather_limited([
+            lambda plant_id=plant_id: fetch_json("GET", flow_endpoint.format(plant_id), headers_and_token,
+                                                 allow_stale=False, extract=FLOW_FIELDS)
+            for plant_id in self.plant_ids])
+        rows = []
+        for plant_id, flow_response in zip(self.plant_ids, flow_responses):
+            debug_print(f"Flow response for {plant_id}: {flow_response}")
+            flow = flow_response.get('data') if flow_response else None
+            if not flow:
+                print("Energy flow data is missing, falling back to the realtime endpoints.")
+                return False
+
+            # The flow endpoint reports magnitudes plus direction flags; convert
+            # them to the realtime endpoints' signs (battery negative while
+            # charging, grid negative while exporting).
+            battery_power = abs(int(flow.get('battPower') or 0))
+            grid_power = abs(int(flow.get('gridOrMeterPower') or 0))
+            rows.append((
+                f"#{str(plant_id)[-4:]}",
+                int(flow.get('pvPower') or 0),
+                int(flow.get('loadOrEpsPower') or 0),
+                -battery_power if flow.get('toBat') else battery_power,
+                -grid_power if flow.get('toGrid') else grid_power,
+                round(float(flow['soc'])) if flow.get('soc') is not None else None
+            ))
+
+        self.combine(rows)
+        self.pv_power = sum(row[1] for row in self.rows)
+        self.plants = [(plant_id, row[1]) for plant_id, row in zip(self.plant_ids, self.rows)]
+        self.fetched_at = time.time()
+        return True
+
+    async def fetch_realtime(self):
+        """Fill the snapshot from the plants list and every inverter's battery, grid and load endpoints."""
+        headers_and_token = auth_headers()
+        inverter_serials = config.credentials()[2]
+        jobs = []
+        for serial in inverter_serials:
+            jobs.append(("GET", inverter_endpoint.format(serial), headers_and_token, BATTERY_FIELDS))
+            jobs.append(("GET", grid_endpoint.format(serial), headers_and_token, VIP_FIELDS))
+            jobs.append(("GET", load_endpoint.format(serial), headers_and_token, VIP_FIELDS))
+        # Only fresh responses count, as an open breaker's last good ones would pass old readings off as new
+        plants_read, responses = await uasyncio.gather(self.fetch_plants(headers_and_token, allow_stale=False),
+                                                       fetch_all(jobs, allow_stale=False))
+
+        rows = []
+        for i, serial in enumerate(inverter_serials):
+            inverter_response, grid_response, load_response = responses[3 * i:3 * i + 3]
+            debug_print(f"Inverter response for {serial}: {inverter_response}")
+            debug_print(f"Grid response for {serial}: {grid_response}")
+            debug_print(f"Load response for {serial}: {load_response}")
+
+            soc = battery_power = grid_power = load_power = None
+            battery = inverter_response.get('data') if inverter_response else None
+            if battery:
+                if battery.get('soc') is not None:
+                    soc = round(float(battery['soc']))
+                if battery.get('power') is not None:
+                    battery_power = int(battery['power'])
+            else:
+                print(f"Inverter data for {serial} is missing, keeping the previous SOC.")
+
+            grid_vip = grid_response['data'].get('vip') if grid_response and grid_response.get('data') else None
+            if grid_vip:
+                grid_power = int(grid_vip[0]['power'])
+
+            load_vip = load_response['data'].get('vip') if load_response and load_response.get('data') else None
+            if load_vip:
+                load_power = int(load_vip[0]['power'])
+
+            # PV is only reported per plant, so a lone inverter gets the plants' total
+            pv = self.pv_power if len(inverter_serials) == 1 else None
+            rows.append((f"#{serial[-4:]}", pv, load_power, battery_power, grid_power, soc))
+
+        self.combine(rows)
+        if plants_read or any(responses):
+            self.fetched_at = time.time()
+
+
+inverter = InverterSnapshot()
+# PV, load, battery and grid watts for each HISTORY_STEP of the last day
+power_history = PowerHistory(HISTORY_FILE, HISTORY_STEP, 86400 // HISTORY_STEP, 4, HISTORY_BLOCK)
+
+
+def get_soc():
+    """Get the state of charge for the battery."""
+    return run_async(inverter.refresh()).soc
+
+
+async def backfill_history():
+    """Refill today's power history from each plant's day chart after a gap, such as a power cut.
+
+    Each plant's chart comes in one request, and the plants' readings are
+    added together. Steps that already have readings are left alone."""
+    now = unix_time()
+    gap = power_history.gap(now)
+    if gap is not None and gap < HISTORY_BACKFILL_GAP:
+        return
+    headers_and_token = auth_headers()
+    if not inverter.plant_ids and not await inverter.fetch_plants(headers_and_token):
+        return
+    offset = local_utc_offset(now)
+    local = time.gmtime(now - EPOCH_OFFSET + offset)
+    date = f"{local[0]}-{local[1]:02d}-{local[2]:02d}"
+    responses = await gather_limited([
+        lambda plant_id=plant_id: fetch_json("GET", history_endpoint.format(plant_id, date), headers_and_token,
+                                             allow_stale=False, extract=HISTORY_FIELDS)
+        for plant_id in inverter.plant_ids])
+
+    totals = {}  # minutes past local midnight -> [pv, load, battery, grid] summed over the plants
+    malformed = 0
+    for response in responses:
+        infos = response['data'].get('infos') if response and response.get('data') else None
+        for info in infos or ():
+            series = HISTORY_SERIES.get(info.get('label')) if isinstance(info, dict) else None
+            if series is None:
+                continue
+            for point in info.get('records') or ():
+                try:
+                    hours, _, minutes = point['time'].partition(":")
+                    minute, value = int(hours) * 60 + int(minutes), round(float(point['value']))
+                except (KeyError, TypeError, ValueError, AttributeError):
+                    malformed += 1
+                    continue
+                readings = totals.setdefault(minute, [None] * 4)
+                readings[series] = (readings[series] or 0) + value
+    if malformed:
+        print(f"Skipped {malformed} malformed day chart points")
+    if not totals:
+        print("No day chart to backfill the power history from")
+        return
+
+    midnight = now - (now + offset) % 86400
+    for minute in sorted(totals):
+        if midnight + minute * 60 <= now:
+            power_history.put(midnight + minute * 60, totals[minute], keep=True)
+    power_history.save()
+    print(f"Backfilled {len(totals)} steps of power history")
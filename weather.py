@@ -0,0 +1,316 @@
+"""Open-Meteo forecasts, held compactly and cached for every screen.
+
+Forecasts are kept as Forecast objects, one per location, in an LRU cache
+of WEATHER_CACHE_BUDGET bytes; each entry lives WEATHER_CACHE_TTL seconds."""
+
+import uasyncio
+import time
+import struct
+from array import array
+
+import config
+from config import WEATHER_CACHE_TTL, WEATHER_CACHE_BUDGET, DOW, EPOCH_OFFSET, debug_print
+from net import async_retry_request
+
+
+# Every screen reads forecasts through weather_for(). WEATHER_FULL is the
+# superset the local screens need; WEATHER_DAILY is enough for the remote
+# list, and a cached WEATHER_FULL entry satisfies a WEATHER_DAILY lookup.
+WEATHER_DAILY, WEATHER_FULL = range(2)
+WEATHER_QUERIES = [
+    'daily=temperature_2m_max,temperature_2m_min&forecast_days=1',
+    'current=temperature_2m&hourly=temperature_2m,precipitation_probability&forecast_hours=12&daily=temperature_2m_max,temperature_2m_min,precipitation_probability_max,sunrise,sunset&wind_speed_unit=mph&precipitation_unit=inch&forecast_days=5',
+]
+# Fields kept from each query's response. Hourly times are evenly spaced, so
+# only the first is needed.
+WEATHER_FIELDS = [
+    ['utc_offset_seconds', 'daily.time', 'daily.temperature_2m_max', 'daily.temperature_2m_min'],
+    ['utc_offset_seconds', 'current.temperature_2m', 'current.time',
+     'hourly.time[0]', 'hourly.temperature_2m', 'hourly.precipitation_probability',
+     'daily.time', 'daily.temperature_2m_max', 'daily.temperature_2m_min', 'daily.precipitation_probability_max',
+     'daily.sunrise', 'daily.sunset'],
+]
+
+
+def unix_time():
+    """Seconds since 1970, whatever epoch this port uses."""
+    return int(time.time()) + EPOCH_OFFSET
+
+
+def _series(typecode, values):
+    """Pack a forecast series into an array, treating missing values as 0."""
+    return array(typecode, [value or 0 for value in values or ()])
+
+
+class Forecast:
+    """One location's forecast held in compact arrays, indexed by Unix time.
+
+    Forecasts are requested with timeformat=unixtime. Hourly values are found
+    from the epoch hour and daily values from the local day number, so
+    lookups are O(1) and labels come from integer maths instead of parsing
+    date strings. Each day's local midnight is kept so the UTC offset is
+    worked out for the day in question, which keeps labels right across a
+    DST change within the forecast."""
+
+    def __init__(self, data):
+        self.utc_offset = data.get('utc_offset_seconds') or 0
+        current = data.get('current') or {}
+        self.current_temp = current.get('temperature_2m')
+        self.current_time = current.get('time')
+
+        hourly = data.get('hourly') or {}
+        self.hour0 = hourly['time'][0] // 3600 if hourly.get('time') else 0  # epoch hour of the first value
+        self.hourly_temp = _series('f', hourly.get('temperature_2m'))
+        self.hourly_rain = _series('B', hourly.get('precipitation_probability'))
+
+        daily = data.get('daily') or {}
+        self.midnights = _series('i', daily.get('time'))  # Unix time each local day starts
+        # utc_offset is the offset now, which after a DST change today isn't the one at midnight;
+        # rounding to the nearest day boundary allows for that
+        self.day0 = (self.midnights[0] + self.utc_offset + 43200) // 86400 if self.midnights else 0
+        self.daily_max = _series('f', daily.get('temperature_2m_max'))
+        self.daily_min = _series('f', daily.get('temperature_2m_min'))
+        self.daily_rain = _series('B', daily.get('precipitation_probability_max'))
+        self.sunrises = _series('i', daily.get('sunrise'))
+        self.sunsets = _series('i', daily.get('sunset'))
+
+    def as_dict(self):
+        """The forecast in Open-Meteo's response shape; Forecast(f.as_dict()) rebuilds it."""
+        return {
+            'utc_offset_seconds': self.utc_offset,
+            'current': {'temperature_2m': self.current_temp, 'time': self.current_time},
+            'hourly': {
+                'time': [self.hour0 * 3600],
+                'temperature_2m': [round(value, 1) for value in self.hourly_temp],
+                'precipitation_probability': list(self.hourly_rain)
+            },
+            'daily': {
+                'time': list(self.midnights),
+                'temperature_2m_max': [round(value, 1) for value in self.daily_max],
+                'temperature_2m_min': [round(value, 1) for value in self.daily_min],
+                'precipitation_probability_max': list(self.daily_rain),
+                'sunrise': list(self.sunrises),
+                'sunset': list(self.sunsets)
+            }
+        }
+
+    # Arrays packed by to_bytes(), in order, with their typecodes
+    SERIES = (('hourly_temp', 'f'), ('hourly_rain', 'B'), ('midnights', 'i'), ('daily_max', 'f'),
+              ('daily_min', 'f'), ('daily_rain', 'B'), ('sunrises', 'i'), ('sunsets', 'i'))
+    HEADER = "<ifii"  # utc_offset, current_temp (NaN if unknown), current_time (0 if unknown), hour0
+
+    def to_bytes(self):
+        """The forecast packed for the last known good store; Forecast.from_bytes() rebuilds it."""
+        current_temp = float('nan') if self.current_temp is None else self.current_temp
+        parts = [struct.pack(self.HEADER, self.utc_offset, current_temp, self.current_time or 0, self.hour0)]
+        for name, typecode in self.SERIES:
+            values = getattr(self, name)
+            parts.append(struct.pack(f"<H{len(values)}{typecode}", len(values), *values))
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Rebuild a forecast packed by to_bytes()."""
+        forecast = cls({})
+        utc_offset, current_temp, current_time, forecast.hour0 = struct.unpack_from(cls.HEADER, data, 0)
+        forecast.utc_offset = utc_offset
+        # NaN is the only value not equal to itself
+        forecast.current_temp = round(current_temp, 1) if current_temp == current_temp else None
+        forecast.current_time = current_time or None
+        pos = struct.calcsize(cls.HEADER)
+        for name, typecode in cls.SERIES:
+            count = struct.unpack_from("<H", data, pos)[0]
+            pos += 2
+            setattr(forecast, name, array(typecode, struct.unpack_from(f"<{count}{typecode}", data, pos)))
+            pos += count * struct.calcsize(typecode)
+        forecast.day0 = (forecast.midnights[0] + utc_offset + 43200) // 86400 if forecast.midnights else 0
+        return forecast
+
+    def size(self):
+        """Approximate heap use in bytes, for the weather cache budget."""
+        return 64 + 4 * (len(self.hourly_temp) + len(self.midnights) + len(self.daily_max) + len(self.daily_min)
+                         + len(self.sunrises) + len(self.sunsets)) + len(self.hourly_rain) + len(self.daily_rain)
+
+    def offset_at(self, t):
+        """UTC offset in seconds in force at Unix time t."""
+        if not self.midnights:
+            return self.utc_offset
+        # Local days are 23 to 25 hours long, so the estimate is at most one day out
+        i = min(max((t - self.midnights[0]) // 86400, 0), len(self.midnights) - 1)
+        while i + 1 < len(self.midnights) and self.midnights[i + 1] <= t:
+            i += 1
+        while i > 0 and self.midnights[i] > t:
+            i -= 1
+        # A day that isn't 24 hours long has a DST change, after which the
+        # next day's offset applies
+        if i + 1 < len(self.midnights) and self.midnights[i + 1] - self.midnights[i] != 86400 \
+                and t >= self.dst_change(i):
+            i += 1
+        return (self.day0 + i) * 86400 - self.midnights[i]
+
+    def dst_change(self, i):
+        """Unix time the UTC offset changes during local day i, a day that isn't 24 hours long.
+
+        The forecast only shows that the offset changes that day, not when,
+        so the usual rules are assumed: zones from UTC-1 to UTC+3 (Europe)
+        change at 01:00 UTC; zones further east (Australia, New Zealand) at
+        02:00 local time going forward and 03:00 going back; and the rest
+        (the Americas) at 02:00, all by the clock before the change. Zones
+        with other rules, such as Chile or Iran, get labels an hour out
+        around their change."""
+        offset = (self.day0 + i) * 86400 - self.midnights[i]  # in force at the day's local midnight
+        if -3600 <= offset <= 3 * 3600:
+            return (self.day0 + i) * 86400 + 3600
+        if offset > 3 * 3600 and self.midnights[i + 1] - self.midnights[i] > 86400:
+            return self.midnights[i] + 3 * 3600
+        return self.midnights[i] + 2 * 3600
+
+    def local_day(self, t):
+        """Days since 1970-01-01 in the location's time zone."""
+        return (t + self.offset_at(t)) // 86400
+
+    def clock(self, t):
+        """Local HH:MM label for Unix time t."""
+        local = t + self.offset_at(t)
+        return f"{(local // 3600) % 24:02d}:{(local // 60) % 60:02d}"
+
+    def next_hours(self, t, count):
+        """(HH:MM label, temperature, rain %) for the `count` hours after t."""
+        hours = []
+        start = t // 3600 - self.hour0 + 1
+        for i in range(max(start, 0), min(start + count, len(self.hourly_temp))):
+            hours.append((self.clock((self.hour0 + i) * 3600), self.hourly_temp[i], self.hourly_rain[i]))
+        return hours
+
+    def daylight(self, t):
+        """Return (True if the sun is up at Unix time t, Unix time of the next sunrise or sunset).
+
+        Returns None when t is past the last sunset in the forecast."""
+        for sunrise, sunset in zip(self.sunrises, self.sunsets):
+            if t < sunrise:
+                return False, sunrise
+            if t < sunset:
+                return True, sunset
+        return None
+
+    def next_days(self, t, count):
+        """(weekday, min, max, rain %) for `count` days starting with today."""
+        days = []
+        start = self.local_day(t) - self.day0
+        for i in range(max(start, 0), min(start + count, len(self.daily_max))):
+            rain = self.daily_rain[i] if i < len(self.daily_rain) else 0
+            # 1970-01-01 was a Thursday
+            days.append((DOW[(self.day0 + i + 3) % 7], self.daily_min[i], self.daily_max[i], rain))
+        return days
+
+
+# (latitude, longitude) -> {'detail', 'data' (a Forecast), 'size', 'fetched_at', 'used_at'}
+weather_cache = {}
+weather_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+weather_cache_clock = [0]  # Bumped on every access to order entries for LRU eviction
+
+
+def weather_cache_get(location_info, detail, margin=0):
+    """Return cached weather for a location if it is detailed enough and fresh for `margin` seconds more."""
+    entry = weather_cache.get((location_info[0], location_info[1]))
+    if entry and entry['detail'] >= detail and time.time() + margin - entry['fetched_at'] < WEATHER_CACHE_TTL:
+        weather_cache_stats['hits'] += 1
+        weather_cache_clock[0] += 1
+        entry['used_at'] = weather_cache_clock[0]
+        return entry['data']
+    weather_cache_stats['misses'] += 1
+    return None
+
+
+def weather_cache_put(location_info, detail, data, size):
+    """Cache weather for a location, evicting least recently used entries to stay in budget."""
+    key = (location_info[0], location_info[1])
+    old = weather_cache.pop(key, None)
+    if old:
+        weather_cache_stats['bytes'] -= old['size']
+    while weather_cache and weather_cache_stats['bytes'] + size > WEATHER_CACHE_BUDGET:
+        lru_key = min(weather_cache, key=lambda k: weather_cache[k]['used_at'])
+        weather_cache_stats['bytes'] -= weather_cache.pop(lru_key)['size']
+        weather_cache_stats['evictions'] += 1
+    weather_cache_clock[0] += 1
+    weather_cache[key] = {
+        'detail': detail,
+        'data': data,
+        'size': size,
+        'fetched_at': time.time(),
+        'used_at': weather_cache_clock[0]
+    }
+    weather_cache_stats['bytes'] += size
+
+
+async def weather_for(location_infos, detail=WEATHER_FULL, margin=0):
+    """Return a Forecast for each [lat, lon, name] location, in order.
+
+    Cache misses are fetched together in one multi-location request, or
+    one for each level of detail asked for.
+    Locations that could not be fetched come back as their cached forecast,
+    however old, or None if there is none. Cached forecasts
+    due to expire within `margin` seconds count as misses."""
+    results = [weather_cache_get(info, detail, margin) for info in location_infos]
+    missing = [i for i, data in enumerate(results) if data is None]
+    if not missing:
+        return results
+
+    # A location cached in more detail is fetched in that detail again, so a
+    # WEATHER_DAILY lookup never swaps Local's full forecast for a one-day one
+    by_detail = {}
+    for i in missing:
+        entry = weather_cache.get((location_infos[i][0], location_infos[i][1]))
+        by_detail.setdefault(max(detail, entry['detail']) if entry else detail, []).append(i)
+    await uasyncio.gather(*[fetch_weather(location_infos, indexes, fetch_detail, results)
+                            for fetch_detail, indexes in by_detail.items()])
+    return results
+
+
+async def fetch_weather(location_infos, missing, detail, results):
+    """Fetch the locations at the `missing` indexes in one request, caching them and filling in results."""
+    latitudes = ",".join(location_infos[i][0] for i in missing)
+    longitudes = ",".join(location_infos[i][1] for i in missing)
+    endpoint = f'https://api.open-meteo.com/v1/forecast?latitude={latitudes}&longitude={longitudes}&{WEATHER_QUERIES[detail]}&timeformat=unixtime&timezone=auto'
+    response = await async_retry_request("GET", endpoint, extract=WEATHER_FIELDS[detail])
+    if not response:
+        print(f"Error: Failed to fetch weather for {', '.join(location_infos[i][2] for i in missing)}")
+        # Better an old forecast, marked with its age on screen, than none
+        for i in missing:
+            results[i] = cached_forecast(location_infos[i])
+        return
+
+    fetched = response.json()
+    # A single location comes back as an object rather than a list
+    if isinstance(fetched, dict):
+        fetched = [fetched]
+    for i, data in zip(missing, fetched):
+        debug_print(f"Weather response for {location_infos[i][2]}: {data}")
+        forecast = Forecast(data)
+        results[i] = forecast
+        weather_cache_put(location_infos[i], detail, forecast, forecast.size())
+
+
+def cached_forecast(location_info):
+    """Return the cached Forecast for a location, however old, without counting a cache lookup."""
+    entry = weather_cache.get((location_info[0], location_info[1]))
+    return entry['data'] if entry else None
+
+
+def forecast_fetched_at(location_info):
+    """Return when a location's cached forecast was fetched, or None if there is none."""
+    entry = weather_cache.get((location_info[0], location_info[1]))
+    return entry['fetched_at'] if entry else None
+
+
+def local_utc_offset(t):
+    """UTC offset at the Local location, from its most recent forecast."""
+    local = config.local_location()
+    entry = weather_cache.get((local[0], local[1]))
+    return entry['data'].offset_at(t) if entry else 0
+
+
+def forecast_fresh(location_info):
+    """Return True if a location's cached forecast is within WEATHER_CACHE_TTL."""
+    fetched_at = forecast_fetched_at(location_info)
+    return fetched_at is not None and time.time() - fetched_at < WEATHER_CACHE_TTL